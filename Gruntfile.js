@@ -109,7 +109,7 @@ module.exports = function(grunt) {
             cwd: './data/',
             expand: true,
             filter: 'isFile',
-            src: ['**/*.json'],
+            src: ['**/*.json', 'attributes/*.js'],
             dest: 'dist/data/'
           }
         ]
@@ -0,0 +1,310 @@
+"""
+Benchmark processing of parcels.
+
+Runs process-shapefiles.py against synthetic county data (see
+generate-synthetic-parcels.py) and records timings to a baseline file so
+that performance changes can be compared between runs without the real
+county data or network access.
+"""
+
+
+import os, sys, argparse, json, time, platform, subprocess, glob
+
+
+def load_script(name):
+  """
+  Load one of the (dash named) scripts in this directory as a module.
+  """
+  path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '%s.py' % (name))
+  module_name = name.replace('-', '_')
+  try:
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+  except ImportError:
+    import imp
+    return imp.load_source(module_name, path)
+
+
+class ParcelsBenchmark():
+  """
+  Class to handle execution
+  """
+
+  description = """
+  Benchmarks combining and stats for synthetic parcel data and compares
+  against a baseline.
+"""
+
+  script_path = os.path.dirname(os.path.realpath(__file__))
+  synthetic_path = os.path.join(script_path, '../data/synthetic')
+  benchmark_path = os.path.join(script_path, '../data/benchmarks')
+  default_baseline = os.path.join(script_path, '../data/benchmarks/baseline.json')
+
+  # Same order as process-shapefiles.py
+  counties = ['ramsey', 'anoka', 'hennepin']
+
+
+  def __init__(self):
+    """
+    Constructor.
+    """
+    self.processing = load_script('process-shapefiles')
+
+
+  def out(self, message):
+    """
+    Wrapper around stdout
+    """
+    sys.stdout.write(message)
+
+
+  def error(self, message):
+    """
+    Wrapper around stderror
+    """
+    sys.stderr.write(message)
+
+
+  def parcels(self, size):
+    """
+    Make a MetroParcels that reads the synthetic data for a size and writes
+    to the benchmark directory.
+    """
+    source_path = os.path.join(self.synthetic_path, size)
+    combined_path = os.path.join(self.benchmark_path, size, 'metro-combined.shp')
+
+    class BenchmarkParcels(self.processing.MetroParcels):
+      source_shape_hennepin = os.path.join(source_path, 'hennepin-parcels.shp')
+      source_shape_ramsey = os.path.join(source_path, 'ramsey-parcels.shp')
+      source_shape_anoka = os.path.join(source_path, 'anoka-parcels.shp')
+      source_shape_combined = combined_path
+
+      def out(self, message):
+        pass
+
+    return BenchmarkParcels()
+
+
+  def timed(self, method, *args):
+    """
+    Run a method and return how long it took in seconds.
+    """
+    start = time.time()
+    method(*args)
+    return time.time() - start
+
+
+  def generate(self, size):
+    """
+    Generate synthetic data for a size if it is not there yet.
+    """
+    source_path = os.path.join(self.synthetic_path, size)
+    missing = [c for c in self.counties if not os.path.exists(os.path.join(source_path, '%s-parcels.shp' % (c)))]
+    if len(missing) == 0:
+      return
+
+    self.out('- Generating synthetic data for %s\n' % (size))
+    subprocess.check_call([sys.executable, os.path.join(self.script_path, 'generate-synthetic-parcels.py'),
+      '--size', size, '--counties', ','.join(missing), '--seed', self.args.seed])
+
+
+  def file_sizes(self, shape_path):
+    """
+    Size of each component of a shapefile in bytes.
+    """
+    sizes = {}
+    for path in glob.glob(shape_path.replace('.shp', '.*')):
+      sizes[os.path.splitext(path)[1][1:]] = os.path.getsize(path)
+    return sizes
+
+
+  def run_size(self, size):
+    """
+    Run the benchmarks for one size.
+    """
+    results = { 'combine': {} }
+
+    # Combine
+    self.out('- Benchmarking combine for %s\n' % (size))
+    mp = self.parcels(size)
+    mp.get_counts()
+    results['define_combined'] = self.timed(mp.define_combined)
+    for county in self.counties:
+      count = getattr(mp, '%s_count' % (county))
+      seconds = self.timed(mp.combine, county)
+      results['combine'][county] = {
+        'features': count,
+        'seconds': seconds,
+        'features_per_second': count / seconds if seconds > 0 else None
+      }
+    results['finish_combined'] = self.timed(mp.finish_combined)
+    mp.close()
+    results['combine_total'] = sum(c['seconds'] for c in results['combine'].values()) + results['define_combined'] + results['finish_combined']
+    results['shards'] = len(mp.shards)
+    results['output_bytes'] = {}
+    for path in mp.shards:
+      for extension, bytes_ in self.file_sizes(path).items():
+        results['output_bytes'][extension] = results['output_bytes'].get(extension, 0) + bytes_
+    results['output_bytes']['total'] = sum(results['output_bytes'].values())
+
+    # Stats
+    self.out('- Benchmarking stats for %s\n' % (size))
+    mp = self.parcels(size)
+    mp.define_combined(False, False)
+    results['stats_residential_emv'] = self.timed(mp.output_stats, 'residential-1M')
+    mp.close()
+
+    # Attribute store
+    self.out('- Benchmarking attribute store for %s\n' % (size))
+    mp = self.parcels(size)
+    mp.define_combined(False, False)
+    store_path = os.path.join(self.benchmark_path, size, 'metro-attributes.bin')
+    results['attribute_store'] = self.timed(mp.write_attribute_store, store_path)
+    results['output_bytes']['attributes'] = os.path.getsize(store_path)
+    mp.close()
+
+    # Field values
+    self.out('- Benchmarking field values for %s\n' % (size))
+    results['field_values'] = {}
+    for field in ['COUNTY_ID', 'USE1_DESC']:
+      mp = self.parcels(size)
+      mp.define_combined(False, False)
+      results['field_values'][field] = self.timed(mp.output_field_values, field)
+      mp.close()
+
+    return results
+
+
+  def best(self, runs):
+    """
+    Combine repeated runs by taking the fastest time for each measurement.
+    """
+    if isinstance(runs[0], dict):
+      return dict((k, self.best([r[k] for r in runs])) for k in runs[0])
+    if all(isinstance(r, (int, float)) for r in runs):
+      return min(runs)
+    return runs[0]
+
+
+  def flatten(self, results, prefix = ''):
+    """
+    Flatten nested results to dotted keys for comparing.
+    """
+    flat = {}
+    for k, v in results.items():
+      key = '%s.%s' % (prefix, k) if prefix else k
+      if isinstance(v, dict):
+        flat.update(self.flatten(v, key))
+      elif isinstance(v, (int, float)):
+        flat[key] = v
+    return flat
+
+
+  def compare(self, baseline, results):
+    """
+    Output comparison of results against a baseline.
+    """
+    self.out('\n- Compared to baseline from %s:\n' % (baseline['meta']['time']))
+    old = self.flatten(baseline['sizes'])
+    new = self.flatten(results['sizes'])
+    for key in sorted(new.keys()):
+      if key.endswith('.features'):
+        continue
+      if key not in old or not old[key]:
+        self.out('%s: %s (new)\n' % (key, round(new[key], 3)))
+        continue
+
+      change = ((new[key] - old[key]) / float(old[key])) * 100
+      self.out('%s: %s -> %s (%+.1f%%)\n' % (key, round(old[key], 3), round(new[key], 3), change))
+
+
+  def process(self):
+    """
+    Main execution handler.
+    """
+    self.argparser = argparse.ArgumentParser(description = self.description, formatter_class = argparse.RawDescriptionHelpFormatter,)
+
+    self.argparser.add_argument(
+      '--sizes',
+      help = 'Comma separated list of sizes to run, for example "10k,100k,1M".',
+      default = '10k'
+    )
+
+    self.argparser.add_argument(
+      '--repeat',
+      help = 'Number of times to run each size; the fastest time is kept.',
+      type = int,
+      default = 1
+    )
+
+    self.argparser.add_argument(
+      '--seed',
+      help = 'Random seed for generating synthetic data.',
+      default = '2014'
+    )
+
+    self.argparser.add_argument(
+      '--baseline',
+      help = 'Baseline file to compare against.',
+      default = self.default_baseline
+    )
+
+    self.argparser.add_argument(
+      '--save-baseline',
+      help = 'Save these results as the baseline.',
+      action = 'store_true'
+    )
+
+    self.argparser.add_argument(
+      '--output',
+      help = 'Also write results to this file.',
+      default = None
+    )
+
+    # Parse options
+    self.args = self.argparser.parse_args()
+
+    from osgeo import gdal
+    results = {
+      'meta': {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'gdal': gdal.__version__,
+        'platform': platform.platform(),
+        'seed': self.args.seed
+      },
+      'sizes': {}
+    }
+
+    for size in self.args.sizes.split(','):
+      self.generate(size)
+      runs = [self.run_size(size) for r in range(0, self.args.repeat)]
+      results['sizes'][size] = self.best(runs)
+
+    self.out('\n%s\n' % (json.dumps(results, indent = 2, sort_keys = True)))
+
+    # Compare to baseline
+    if os.path.exists(self.args.baseline) and not self.args.save_baseline:
+      with open(self.args.baseline) as f:
+        self.compare(json.load(f), results)
+
+    # Save results
+    paths = [self.args.output] if self.args.output else []
+    if self.args.save_baseline or not os.path.exists(self.args.baseline):
+      paths.append(self.args.baseline)
+    for path in paths:
+      if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+      with open(path, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+      self.out('- Results written to %s\n' % (path))
+
+
+# Handle execution
+if __name__ == '__main__':
+  pb = ParcelsBenchmark()
+  pb.process()
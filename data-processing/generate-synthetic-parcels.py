@@ -0,0 +1,769 @@
+"""
+Generate synthetic county parcel shapefiles.
+
+The real county downloads are too big to commit and need network access, so
+this writes shapefiles with the same schemas as the reprojected Hennepin,
+Ramsey and Anoka sources (see the *_translation methods in
+process-shapefiles.py) that can be used for benchmarking and testing.
+"""
+
+
+import os, sys, argparse, math, random
+from osgeo import ogr, osr
+
+
+# Field definitions as (name, type, width, precision).  Hennepin and Ramsey
+# start with the fields that are used in the translation; these types are
+# inferred from how the translation parses them.  The rest are the "not used"
+# fields documented in process-shapefiles.py.
+HENNEPIN_FIELDS = [
+  ('PID', ogr.OFTString, 80, 0),
+  ('HOUSE_NO', ogr.OFTReal, 11, 0),
+  ('FRAC_HOUSE', ogr.OFTString, 80, 0),
+  ('STREET_NM', ogr.OFTString, 80, 0),
+  ('MUNIC_NM', ogr.OFTString, 80, 0),
+  ('MAILING__1', ogr.OFTString, 80, 0),
+  ('ZIP_CD', ogr.OFTString, 80, 0),
+  ('BLOCK', ogr.OFTString, 80, 0),
+  ('LOT', ogr.OFTString, 80, 0),
+  ('PARCEL_ARE', ogr.OFTReal, 11, 0),
+  ('PROPERTY_T', ogr.OFTString, 80, 0),
+  ('OWNER_NM', ogr.OFTString, 80, 0),
+  ('TAXPAYER_N', ogr.OFTString, 80, 0),
+  ('TAXPAYER_1', ogr.OFTString, 80, 0),
+  ('TAXPAYER_2', ogr.OFTString, 80, 0),
+  ('TAXPAYER_3', ogr.OFTString, 80, 0),
+  ('HMSTD_CD1_', ogr.OFTString, 80, 0),
+  ('EST_LAND_M', ogr.OFTReal, 11, 0),
+  ('EST_BLDG_M', ogr.OFTReal, 11, 0),
+  ('MKT_VAL_TO', ogr.OFTReal, 11, 0),
+  ('NET_TAX_CA', ogr.OFTReal, 11, 0),
+  ('TAX_TOT', ogr.OFTReal, 11, 0),
+  ('BUILD_YR', ogr.OFTString, 80, 0),
+  ('SALE_DATE', ogr.OFTString, 80, 0),
+  ('SALE_PRICE', ogr.OFTReal, 11, 0),
+  ('SCHOOL_DIS', ogr.OFTString, 80, 0),
+  ('WATERSHED_', ogr.OFTString, 80, 0),
+  ('PID_TEXT', ogr.OFTString, 80, 0),
+  ('FEATURECOD', ogr.OFTReal, 11, 0),
+  ('STATE_CD', ogr.OFTReal, 11, 0),
+  ('TORRENS_TY', ogr.OFTString, 80, 0),
+  ('CONDO_NO', ogr.OFTString, 80, 0),
+  ('MUNIC_CD', ogr.OFTString, 80, 0),
+  ('MULTI_ADDR', ogr.OFTString, 80, 0),
+  ('MAILING_MU', ogr.OFTString, 80, 0),
+  ('SEWER_DIST', ogr.OFTString, 80, 0),
+  ('TIF_PROJEC', ogr.OFTString, 80, 0),
+  ('PROPERTY_S', ogr.OFTString, 80, 0),
+  ('FORFEIT_LA', ogr.OFTString, 80, 0),
+  ('CO_OP_IND', ogr.OFTString, 80, 0),
+  ('CONTIG_IND', ogr.OFTString, 80, 0),
+  ('HMSTD_CD1', ogr.OFTString, 80, 0),
+  ('PROPERTY_1', ogr.OFTString, 80, 0),
+  ('PROPERTY_2', ogr.OFTString, 80, 0),
+  ('EST_LAND_1', ogr.OFTReal, 11, 0),
+  ('EST_BLDG_1', ogr.OFTReal, 11, 0),
+  ('PROPERTY_3', ogr.OFTString, 80, 0),
+  ('EST_LAND_2', ogr.OFTReal, 11, 0),
+  ('EST_BLDG_2', ogr.OFTReal, 11, 0),
+  ('PROPERTY_4', ogr.OFTString, 80, 0),
+  ('EST_LAND_3', ogr.OFTReal, 11, 0),
+  ('EST_BLDG_3', ogr.OFTReal, 11, 0),
+  ('ABBREV_ADD', ogr.OFTString, 80, 0),
+  ('ADDITION_N', ogr.OFTString, 80, 0),
+  ('METES_BNDS', ogr.OFTString, 80, 0),
+  ('METES_BN_1', ogr.OFTString, 80, 0),
+  ('METES_BN_2', ogr.OFTString, 80, 0),
+  ('METES_BN_3', ogr.OFTString, 80, 0),
+  ('MORE_METES', ogr.OFTString, 80, 0),
+  ('ABSTR_TORR', ogr.OFTString, 80, 0),
+  ('SALE_CODE', ogr.OFTString, 80, 0),
+  ('SALE_CODE_', ogr.OFTString, 80, 0),
+  ('Shape_Leng', ogr.OFTReal, 24, 15),
+  ('Shape_area', ogr.OFTReal, 24, 15)
+]
+
+RAMSEY_FIELDS = [
+  ('ParcelID', ogr.OFTString, 17, 0),
+  ('BldgNum', ogr.OFTString, 10, 0),
+  ('StrPreDir', ogr.OFTString, 2, 0),
+  ('StrPreType', ogr.OFTString, 6, 0),
+  ('StreetName', ogr.OFTString, 40, 0),
+  ('Unit', ogr.OFTString, 12, 0),
+  ('SiteCity', ogr.OFTString, 30, 0),
+  ('SiteCityPS', ogr.OFTString, 30, 0),
+  ('SiteZIP5', ogr.OFTString, 5, 0),
+  ('SiteZIP4', ogr.OFTString, 4, 0),
+  ('PlatName', ogr.OFTString, 50, 0),
+  ('Block', ogr.OFTString, 5, 0),
+  ('Lot', ogr.OFTString, 5, 0),
+  ('AcresPoly', ogr.OFTReal, 19, 11),
+  ('AcresDeed', ogr.OFTReal, 19, 11),
+  ('UseType1', ogr.OFTString, 100, 0),
+  ('UseType2', ogr.OFTString, 100, 0),
+  ('UseType3', ogr.OFTString, 100, 0),
+  ('UseType4', ogr.OFTString, 100, 0),
+  ('MultiUseYN', ogr.OFTString, 1, 0),
+  ('Landmark', ogr.OFTString, 100, 0),
+  ('HmstdYN', ogr.OFTString, 1, 0),
+  ('EMVLand', ogr.OFTReal, 19, 11),
+  ('EMVBldg', ogr.OFTReal, 19, 11),
+  ('EMVTotal', ogr.OFTReal, 19, 11),
+  ('TaxCap', ogr.OFTReal, 19, 11),
+  ('TotalTax', ogr.OFTReal, 19, 11),
+  ('SpAssess', ogr.OFTReal, 19, 11),
+  ('TaxExYN', ogr.OFTString, 1, 0),
+  ('ExemptUse1', ogr.OFTString, 100, 0),
+  ('ExemptUse2', ogr.OFTString, 100, 0),
+  ('ExemptUse3', ogr.OFTString, 100, 0),
+  ('ExemptUse4', ogr.OFTString, 100, 0),
+  ('DwellType', ogr.OFTString, 30, 0),
+  ('HomeStyle', ogr.OFTString, 30, 0),
+  ('LivingSqFt', ogr.OFTReal, 19, 11),
+  ('GarageYN', ogr.OFTString, 1, 0),
+  ('GarageSqFt', ogr.OFTString, 11, 0),
+  ('BasementYN', ogr.OFTString, 1, 0),
+  ('HeatType', ogr.OFTString, 30, 0),
+  ('CoolType', ogr.OFTString, 30, 0),
+  ('YearBuilt', ogr.OFTInteger, 4, 0),
+  ('LivingUnit', ogr.OFTString, 6, 0),
+  ('LastSale', ogr.OFTDate, 10, 0),
+  ('SalePrice', ogr.OFTReal, 19, 11),
+  ('SchDistNum', ogr.OFTString, 6, 0),
+  ('WshdTax', ogr.OFTString, 50, 0),
+  ('GrnAcresYN', ogr.OFTString, 1, 0),
+  ('OpenSpcYN', ogr.OFTString, 1, 0),
+  ('AgPYN', ogr.OFTString, 1, 0),
+  ('AgPEnroll', ogr.OFTDate, 10, 0),
+  ('AgPExpire', ogr.OFTDate, 10, 0),
+  ('FIPsPID', ogr.OFTString, 17, 0),
+  ('RollType', ogr.OFTString, 1, 0),
+  ('BldgSuf', ogr.OFTString, 3, 0),
+  ('StrSufType', ogr.OFTString, 4, 0),
+  ('StrSufDir', ogr.OFTString, 2, 0),
+  ('StrNameAll', ogr.OFTString, 40, 0),
+  ('SiteAdd', ogr.OFTString, 70, 0),
+  ('SiteZIP', ogr.OFTString, 12, 0),
+  ('SiteCSZ', ogr.OFTString, 60, 0),
+  ('PrimLast', ogr.OFTString, 65, 0),
+  ('PrimName', ogr.OFTString, 65, 0),
+  ('PrimName1', ogr.OFTString, 65, 0),
+  ('PrimName2', ogr.OFTString, 65, 0),
+  ('PrimAdd1', ogr.OFTString, 30, 0),
+  ('PrimAdd2', ogr.OFTString, 30, 0),
+  ('PrimAdd', ogr.OFTString, 60, 0),
+  ('PrimCity', ogr.OFTString, 20, 0),
+  ('PrimState', ogr.OFTString, 2, 0),
+  ('PrimZIP5', ogr.OFTString, 5, 0),
+  ('PrimZIP4', ogr.OFTString, 4, 0),
+  ('PrimCntry', ogr.OFTString, 20, 0),
+  ('PrimCSZ', ogr.OFTString, 60, 0),
+  ('AltName1', ogr.OFTString, 65, 0),
+  ('AltName2', ogr.OFTString, 65, 0),
+  ('AltAdd1', ogr.OFTString, 30, 0),
+  ('AltAdd2', ogr.OFTString, 30, 0),
+  ('AltAdd', ogr.OFTString, 60, 0),
+  ('AltCity', ogr.OFTString, 20, 0),
+  ('AltState', ogr.OFTString, 2, 0),
+  ('AltZIP5', ogr.OFTString, 5, 0),
+  ('AltZIP4', ogr.OFTString, 4, 0),
+  ('AltCntry', ogr.OFTString, 20, 0),
+  ('AltCSZ', ogr.OFTString, 40, 0),
+  ('HmstdName1', ogr.OFTString, 65, 0),
+  ('HmstdName2', ogr.OFTString, 65, 0),
+  ('HmstdAdd1', ogr.OFTString, 30, 0),
+  ('HmstdAdd2', ogr.OFTString, 30, 0),
+  ('HmstdAdd', ogr.OFTString, 60, 0),
+  ('HmstdCity', ogr.OFTString, 20, 0),
+  ('HmstdState', ogr.OFTString, 2, 0),
+  ('HmstdZIP5', ogr.OFTString, 5, 0),
+  ('HmstdZIP4', ogr.OFTString, 4, 0),
+  ('HmstdCSZ', ogr.OFTString, 60, 0),
+  ('TIFDist', ogr.OFTString, 10, 0),
+  ('SchDist', ogr.OFTString, 50, 0),
+  ('WshdIDTax', ogr.OFTString, 3, 0),
+  ('WshdPoly', ogr.OFTString, 60, 0),
+  ('PlatID', ogr.OFTString, 20, 0),
+  ('TaxDesc', ogr.OFTString, 254, 0),
+  ('PlatDate', ogr.OFTDate, 10, 0),
+  ('Abstract', ogr.OFTString, 14, 0),
+  ('Torrens', ogr.OFTString, 14, 0),
+  ('SqFt', ogr.OFTReal, 19, 11),
+  ('Frontage', ogr.OFTReal, 19, 11),
+  ('LoanCo', ogr.OFTString, 10, 0),
+  ('LoanCoName', ogr.OFTString, 30, 0),
+  ('TaxYear', ogr.OFTInteger, 4, 0),
+  ('EMVYear', ogr.OFTInteger, 4, 0),
+  ('TaxYear1', ogr.OFTInteger, 4, 0),
+  ('EMVYear1', ogr.OFTInteger, 4, 0),
+  ('EMVLand1', ogr.OFTReal, 19, 11),
+  ('EMVBldg1', ogr.OFTReal, 19, 11),
+  ('EMVTotal1', ogr.OFTReal, 19, 11),
+  ('TotalTax1', ogr.OFTReal, 19, 11),
+  ('SpAssess1', ogr.OFTReal, 19, 11),
+  ('TaxYear2', ogr.OFTInteger, 4, 0),
+  ('EMVYear2', ogr.OFTInteger, 4, 0),
+  ('EMVLand2', ogr.OFTReal, 19, 11),
+  ('EMVBldg2', ogr.OFTReal, 19, 11),
+  ('EMVTotal2', ogr.OFTReal, 19, 11),
+  ('TotalTax2', ogr.OFTReal, 19, 11),
+  ('SpAssess2', ogr.OFTReal, 19, 11),
+  ('LUC', ogr.OFTString, 43, 0),
+  ('HmstdDesc', ogr.OFTString, 45, 0),
+  ('Structure', ogr.OFTString, 32, 0),
+  ('ExtWall', ogr.OFTString, 16, 0),
+  ('Stories', ogr.OFTInteger, 4, 0),
+  ('RoomTotal', ogr.OFTInteger, 4, 0),
+  ('BedRoom', ogr.OFTInteger, 4, 0),
+  ('FamilyRoom', ogr.OFTInteger, 4, 0),
+  ('Topology', ogr.OFTString, 12, 0),
+  ('Utility', ogr.OFTString, 16, 0),
+  ('X', ogr.OFTReal, 19, 11),
+  ('Y', ogr.OFTReal, 19, 11),
+  ('Latitude', ogr.OFTReal, 19, 11),
+  ('Longitude', ogr.OFTReal, 19, 11),
+  ('ParcelCode', ogr.OFTInteger, 4, 0),
+  ('JoinDate', ogr.OFTDate, 10, 0)
+]
+
+# Anoka comes from MetroGIS and already uses the combined schema, which is
+# documented field by field in hennepin_translation.
+ANOKA_FIELDS = [
+  ('COUNTY_ID', ogr.OFTString, 3, 0),
+  ('PIN', ogr.OFTString, 17, 0),
+  ('BLDG_NUM', ogr.OFTString, 10, 0),
+  ('PREFIX_DIR', ogr.OFTString, 2, 0),
+  ('PREFIXTYPE', ogr.OFTString, 6, 0),
+  ('STREETNAME', ogr.OFTString, 40, 0),
+  ('STREETTYPE', ogr.OFTString, 4, 0),
+  ('SUFFIX_DIR', ogr.OFTString, 2, 0),
+  ('UNIT_INFO', ogr.OFTString, 12, 0),
+  ('CITY', ogr.OFTString, 30, 0),
+  ('CITY_USPS', ogr.OFTString, 30, 0),
+  ('ZIP', ogr.OFTString, 5, 0),
+  ('ZIP4', ogr.OFTString, 4, 0),
+  ('PLAT_NAME', ogr.OFTString, 50, 0),
+  ('BLOCK', ogr.OFTString, 5, 0),
+  ('LOT', ogr.OFTString, 5, 0),
+  ('ACRES_POLY', ogr.OFTReal, 11, 2),
+  ('ACRES_DEED', ogr.OFTReal, 11, 2),
+  ('USE1_DESC', ogr.OFTString, 100, 0),
+  ('USE2_DESC', ogr.OFTString, 100, 0),
+  ('USE3_DESC', ogr.OFTString, 100, 0),
+  ('USE4_DESC', ogr.OFTString, 100, 0),
+  ('MULTI_USES', ogr.OFTString, 1, 0),
+  ('LANDMARK', ogr.OFTString, 100, 0),
+  ('OWNER_NAME', ogr.OFTString, 50, 0),
+  ('OWNER_MORE', ogr.OFTString, 50, 0),
+  ('OWN_ADD_L1', ogr.OFTString, 40, 0),
+  ('OWN_ADD_L2', ogr.OFTString, 40, 0),
+  ('OWN_ADD_L3', ogr.OFTString, 40, 0),
+  ('TAX_NAME', ogr.OFTString, 40, 0),
+  ('TAX_ADD_L1', ogr.OFTString, 40, 0),
+  ('TAX_ADD_L2', ogr.OFTString, 40, 0),
+  ('TAX_ADD_L3', ogr.OFTString, 40, 0),
+  ('HOMESTEAD', ogr.OFTString, 1, 0),
+  ('EMV_LAND', ogr.OFTReal, 11, 0),
+  ('EMV_BLDG', ogr.OFTReal, 11, 0),
+  ('EMV_TOTAL', ogr.OFTReal, 11, 0),
+  ('TAX_CAPAC', ogr.OFTReal, 11, 0),
+  ('TOTAL_TAX', ogr.OFTReal, 11, 0),
+  ('SPEC_ASSES', ogr.OFTReal, 11, 0),
+  ('TAX_EXEMPT', ogr.OFTString, 1, 0),
+  ('XUSE1_DESC', ogr.OFTString, 100, 0),
+  ('XUSE2_DESC', ogr.OFTString, 100, 0),
+  ('XUSE3_DESC', ogr.OFTString, 100, 0),
+  ('XUSE4_DESC', ogr.OFTString, 100, 0),
+  ('DWELL_TYPE', ogr.OFTString, 30, 0),
+  ('HOME_STYLE', ogr.OFTString, 30, 0),
+  ('FIN_SQ_FT', ogr.OFTReal, 11, 0),
+  ('GARAGE', ogr.OFTString, 1, 0),
+  ('GARAGESQFT', ogr.OFTString, 11, 0),
+  ('BASEMENT', ogr.OFTString, 1, 0),
+  ('HEATING', ogr.OFTString, 30, 0),
+  ('COOLING', ogr.OFTString, 30, 0),
+  ('YEAR_BUILT', ogr.OFTInteger, 4, 0),
+  ('NUM_UNITS', ogr.OFTString, 6, 0),
+  ('SALE_DATE', ogr.OFTDate, 10, 0),
+  ('SALE_VALUE', ogr.OFTReal, 11, 0),
+  ('SCHOOL_DST', ogr.OFTString, 6, 0),
+  ('WSHD_DIST', ogr.OFTString, 50, 0),
+  ('GREEN_ACRE', ogr.OFTString, 1, 0),
+  ('OPEN_SPACE', ogr.OFTString, 1, 0),
+  ('AG_PRESERV', ogr.OFTString, 1, 0),
+  ('AGPRE_ENRD', ogr.OFTDate, 10, 0),
+  ('AGPRE_EXPD', ogr.OFTDate, 10, 0),
+  ('PARC_CODE', ogr.OFTInteger, 2, 0)
+]
+
+
+class SyntheticParcels():
+  """
+  Class to handle execution
+  """
+
+  description = """
+  Generates synthetic county parcel shapefiles with the same schemas as the
+  real sources.  Sizes are features per county and can be given like 10k,
+  100k or 1M.
+"""
+
+  script_path = os.path.dirname(os.path.realpath(__file__))
+  default_output_path = os.path.join(script_path, '../data/synthetic')
+
+  # Rough extents (EPSG:4326) of where parcels are in each county.  PINs
+  # end with the feature index so they are unique at any size, which
+  # diffing needs.
+  counties = {
+    'hennepin': {
+      'fields': HENNEPIN_FIELDS,
+      'pin_field': 'PID',
+      'extent': (-93.767, 44.786, -93.177, 45.245),
+      'cities': ['MINNEAPOLIS', 'BLOOMINGTON', 'PLYMOUTH', 'EDEN PRAIRIE', 'MINNETONKA', 'EDINA', 'RICHFIELD', 'MAPLE GROVE', 'BROOKLYN PARK'],
+      'uses': [('RESIDENTIAL', 62), ('CONDOMINIUM', 10), ('APARTMENT', 4), ('TOWNHOUSE', 6), ('COMMERCIAL', 6), ('INDUSTRIAL', 3), ('RESIDENTIAL LAKE SHORE', 2), ('VACANT LAND - RESIDENTIAL', 5), ('TAX EXEMPT', 2)],
+      'median_emv': 235000
+    },
+    'ramsey': {
+      'fields': RAMSEY_FIELDS,
+      'pin_field': 'ParcelID',
+      'extent': (-93.227, 44.891, -92.984, 45.124),
+      'cities': ['SAINT PAUL', 'MAPLEWOOD', 'ROSEVILLE', 'WHITE BEAR LAKE', 'SHOREVIEW', 'NEW BRIGHTON', 'ARDEN HILLS'],
+      'uses': [('Res 1 unit', 70), ('Res 2-3 units', 9), ('Apt 4+ units', 3), ('Commercial', 7), ('Industrial', 3), ('Res V Land', 6), ('Exempt', 2)],
+      'median_emv': 195000
+    },
+    'anoka': {
+      'fields': ANOKA_FIELDS,
+      'pin_field': 'PIN',
+      'extent': (-93.513, 45.124, -93.010, 45.414),
+      'cities': ['BLAINE', 'COON RAPIDS', 'ANDOVER', 'RAMSEY', 'FRIDLEY', 'ANOKA', 'HAM LAKE', 'LINO LAKES'],
+      'uses': [('RESIDENTIAL', 68), ('RESIDENTIAL LAKE SHORE', 3), ('TOWNHOUSE', 7), ('CONDOMINIUMS', 3), ('COMMERCIAL', 5), ('INDUSTRIAL', 3), ('AGRICULTURAL', 4), ('VACANT LAND', 7)],
+      'median_emv': 185000
+    }
+  }
+
+  county_ids = { 'hennepin': '27', 'ramsey': '62', 'anoka': '2' }
+  streets = ['MAIN', 'LAKE', 'PARK', 'OAK', 'ELM', 'CEDAR', 'MAPLE', 'PINE', 'WASHINGTON', 'LYNDALE', 'UNIVERSITY', 'SNELLING', 'CENTRAL', 'HIAWATHA', 'FRANCE', 'XERXES']
+  street_types = ['AVE', 'ST', 'BLVD', 'DR', 'LN', 'CT', 'RD']
+  directions = [None, None, None, 'N', 'S', 'E', 'W', 'NE', 'SE']
+  surnames = ['JOHNSON', 'ANDERSON', 'NELSON', 'OLSON', 'PETERSON', 'LARSON', 'SMITH', 'NGUYEN', 'HANSON', 'MILLER', 'VANG', 'THAO']
+  watersheds = ['MISSISSIPPI', 'MINNEHAHA CREEK', 'NINE MILE CREEK', 'RICE CREEK', 'COON CREEK', 'CAPITOL REGION', 'BASSETT CREEK']
+
+  # Meters per degree of latitude; longitude is scaled by latitude.
+  meters_per_degree = 111320.0
+  lots_per_block = 12
+  invalid_rate = 0.001
+
+
+  def __init__(self):
+    """
+    Constructor.
+    """
+    self.out_driver = ogr.GetDriverByName('ESRI Shapefile')
+    self.spatial_reference = osr.SpatialReference()
+    self.spatial_reference.ImportFromEPSG(4326)
+
+
+  def out(self, message):
+    """
+    Wrapper around stdout
+    """
+    sys.stdout.write(message)
+
+
+  def error(self, message):
+    """
+    Wrapper around stderror
+    """
+    sys.stderr.write(message)
+
+
+  def parse_size(self, s):
+    """
+    Parse a size like 10k or 1M into a number of features.
+    """
+    multipliers = { 'k': 1000, 'm': 1000000 }
+    s = s.strip().lower()
+    if s[-1:] in multipliers:
+      return int(float(s[:-1]) * multipliers[s[-1:]])
+    return int(s)
+
+
+  def weighted_choice(self, choices):
+    """
+    Pick from a list of (value, weight).
+    """
+    total = sum(w for v, w in choices)
+    r = self.random.uniform(0, total)
+    upto = 0
+    for v, w in choices:
+      upto = upto + w
+      if upto >= r:
+        return v
+    return choices[-1][0]
+
+
+  def ring_area(self, ring, latitude):
+    """
+    Approximate area of a ring in square meters.
+    """
+    area = 0.0
+    for i in range(0, len(ring) - 1):
+      area = area + (ring[i][0] * ring[i + 1][1]) - (ring[i + 1][0] * ring[i][1])
+    return abs(area / 2.0) * (self.meters_per_degree ** 2) * math.cos(math.radians(latitude))
+
+
+  def ring_length(self, ring, latitude):
+    """
+    Approximate perimeter of a ring in meters.
+    """
+    length = 0.0
+    scale = math.cos(math.radians(latitude))
+    for i in range(0, len(ring) - 1):
+      dx = (ring[i + 1][0] - ring[i][0]) * scale
+      dy = ring[i + 1][1] - ring[i][1]
+      length = length + math.sqrt(dx * dx + dy * dy)
+    return length * self.meters_per_degree
+
+
+  def blocks(self, extent, count):
+    """
+    Generate rings for parcels.  Parcels are laid out in blocks of two rows
+    of lots that share edges (like a real plat), with streets between blocks.
+    Shared corners are jittered so that edges are not perfectly square but
+    neighboring parcels still line up.
+    """
+    minx, miny, maxx, maxy = extent
+    latitude = (miny + maxy) / 2.0
+    lon_meter = 1.0 / (self.meters_per_degree * math.cos(math.radians(latitude)))
+    lat_meter = 1.0 / self.meters_per_degree
+
+    lot_width = 18.0
+    lot_depth = 40.0
+    street = 20.0
+    block_width = self.lots_per_block * lot_width + street
+    block_height = 2 * lot_depth + street
+
+    # Spread blocks over the extent, packing them tighter if there are more
+    # parcels than fit at normal density.
+    blocks_needed = int(math.ceil(count / float(self.lots_per_block * 2)))
+    width_meters = (maxx - minx) / lon_meter
+    height_meters = (maxy - miny) / lat_meter
+    columns = max(1, int(math.ceil(math.sqrt(blocks_needed * (width_meters / block_width) / (height_meters / block_height)))))
+    rows = int(math.ceil(blocks_needed / float(columns)))
+    spacing_x = max(block_width, width_meters / columns)
+    spacing_y = max(block_height, height_meters / rows)
+
+    generated = 0
+    for row in range(0, rows):
+      for column in range(0, columns):
+        if generated >= count:
+          return
+
+        origin_x = minx + (column * spacing_x * lon_meter)
+        origin_y = miny + (row * spacing_y * lat_meter)
+
+        # Grid of shared, jittered corners: lots + 1 columns, 3 rows.
+        corners = []
+        for j in range(0, 3):
+          corner_row = []
+          for i in range(0, self.lots_per_block + 1):
+            corner_row.append((
+              origin_x + (i * lot_width + self.random.uniform(-1.5, 1.5)) * lon_meter,
+              origin_y + (j * lot_depth + self.random.uniform(-1.5, 1.5)) * lat_meter
+            ))
+          corners.append(corner_row)
+
+        for j in range(0, 2):
+          for i in range(0, self.lots_per_block):
+            if generated >= count:
+              return
+
+            ring = [corners[j][i], corners[j][i + 1], corners[j + 1][i + 1], corners[j + 1][i]]
+
+            # Some lots have a curved street frontage.
+            if self.random.random() < 0.2:
+              front = 0 if j == 0 else 2
+              a = ring[front]
+              b = ring[front + 1]
+              bulge = self.random.uniform(1, 4) * (-1 if j == 0 else 1)
+              ring.insert(front + 1, ((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0 + bulge * lat_meter))
+
+            # A small number of county polygons are invalid (self
+            # intersecting); make some bowties.
+            if self.random.random() < self.invalid_rate:
+              ring[-1], ring[-2] = ring[-2], ring[-1]
+
+            ring.append(ring[0])
+            generated = generated + 1
+            yield ring, latitude, row * columns + column, j * self.lots_per_block + i
+
+
+  def values(self, county):
+    """
+    Generate the common values for a parcel.
+    """
+    options = self.counties[county]
+    values = {}
+    values['use'] = self.weighted_choice(options['uses'])
+    values['homestead'] = self.random.random() < 0.65 and values['use'].upper().startswith('RES')
+    values['emv_total'] = float(int(self.random.lognormvariate(math.log(options['median_emv']), 0.6)) // 100 * 100)
+    if values['use'].upper().startswith('VACANT') or values['use'].endswith('V Land'):
+      values['emv_land'] = values['emv_total']
+    else:
+      values['emv_land'] = float(int(values['emv_total'] * self.random.uniform(0.15, 0.4)) // 100 * 100)
+    values['emv_bldg'] = values['emv_total'] - values['emv_land']
+    values['tax_capacity'] = round(values['emv_total'] * (0.01 if values['homestead'] else 0.015))
+    values['total_tax'] = round(values['emv_total'] * self.random.uniform(0.009, 0.016))
+    values['year_built'] = None if values['emv_bldg'] == 0 else int(min(2014, 1880 + self.random.betavariate(2.5, 1.6) * 134))
+    values['sale'] = None
+    if self.random.random() < 0.6:
+      values['sale'] = (self.random.randint(1990, 2014), self.random.randint(1, 12), self.random.randint(1, 28))
+      values['sale_price'] = float(int(values['emv_total'] * self.random.uniform(0.75, 1.25)) // 100 * 100)
+    values['house_number'] = self.random.randint(100, 20000)
+    values['street'] = self.random.choice(self.streets)
+    values['street_type'] = self.random.choice(self.street_types)
+    values['direction'] = self.random.choice(self.directions)
+    values['city'] = self.random.choice(options['cities'])
+    values['zip'] = '55%03d' % self.random.randint(300, 449)
+    values['owner'] = '%s %s' % (self.random.choice(self.surnames), self.random.choice(['JOHN', 'MARY', 'DAVID', 'LINDA', 'PAO', 'MAI', 'AHMED', 'ANA']))
+    values['school'] = '%04d' % self.random.choice([1, 11, 13, 16, 191, 270, 271, 272, 273, 276, 280, 281, 282, 621, 622, 623, 624, 625])
+    values['watershed'] = self.random.choice(self.watersheds)
+    return values
+
+
+  def hennepin_feature(self, feature, index, block, lot, ring, latitude, values):
+    """
+    Fill in a Hennepin feature.
+    """
+    area = self.ring_area(ring, latitude)
+    pid = '%02d%02d%02d%07d' % (index % 36 + 1, 29 + (index // 36) % 70, 21 + (block % 5), index)
+    feature.SetField('PID', pid)
+    feature.SetField('PID_TEXT', pid)
+    feature.SetField('HOUSE_NO', float(values['house_number']))
+    if self.random.random() < 0.01:
+      feature.SetField('FRAC_HOUSE', '1/2')
+    feature.SetField('STREET_NM', '%s %s' % (values['street'], values['street_type']))
+    feature.SetField('MUNIC_NM', values['city'])
+    feature.SetField('MAILING__1', values['city'])
+    feature.SetField('ZIP_CD', values['zip'])
+    feature.SetField('BLOCK', str(block % 1000 + 1))
+    feature.SetField('LOT', str(lot + 1))
+    feature.SetField('Shape_area', area)
+    feature.SetField('Shape_Leng', self.ring_length(ring, latitude))
+    feature.SetField('PARCEL_ARE', round(area * 10.7639 * self.random.uniform(0.97, 1.03)))
+    feature.SetField('PROPERTY_T', values['use'])
+    feature.SetField('OWNER_NM', values['owner'])
+    feature.SetField('TAXPAYER_N', values['owner'])
+    feature.SetField('TAXPAYER_1', '%s %s' % (values['house_number'], values['street']))
+    feature.SetField('TAXPAYER_2', '%s MN %s' % (values['city'], values['zip']))
+    feature.SetField('HMSTD_CD1_', 'HOMESTEAD' if values['homestead'] else 'NON-HOMESTEAD')
+    feature.SetField('EST_LAND_M', values['emv_land'])
+    feature.SetField('EST_BLDG_M', values['emv_bldg'])
+    feature.SetField('MKT_VAL_TO', values['emv_total'])
+    feature.SetField('NET_TAX_CA', values['tax_capacity'])
+    feature.SetField('TAX_TOT', values['total_tax'])
+    if values['year_built'] is not None:
+      feature.SetField('BUILD_YR', str(values['year_built']))
+    if values['sale'] is not None:
+      feature.SetField('SALE_DATE', '%04d%02d' % values['sale'][0:2])
+      feature.SetField('SALE_PRICE', values['sale_price'])
+    else:
+      feature.SetField('SALE_DATE', '0')
+    feature.SetField('SCHOOL_DIS', values['school'])
+    feature.SetField('WATERSHED_', values['watershed'])
+    return feature
+
+
+  def ramsey_feature(self, feature, index, block, lot, ring, latitude, values):
+    """
+    Fill in a Ramsey feature.
+    """
+    acres = self.ring_area(ring, latitude) * 0.000247105
+    feature.SetField('ParcelID', '%02d%02d%02d%07d' % (index % 36 + 1, 28 + (index // 36) % 3, 22 + (block % 2), index))
+    feature.SetField('BldgNum', str(values['house_number']))
+    feature.SetField('StrPreDir', values['direction'])
+    feature.SetField('StreetName', values['street'])
+    feature.SetField('StrSufType', values['street_type'])
+    feature.SetField('SiteCity', values['city'])
+    feature.SetField('SiteCityPS', values['city'])
+    feature.SetField('SiteZIP5', values['zip'])
+    feature.SetField('SiteZIP4', '%04d' % self.random.randint(1000, 9999))
+    feature.SetField('PlatName', '%s ADDITION' % (values['street']))
+    feature.SetField('Block', str(block % 1000 + 1))
+    feature.SetField('Lot', str(lot + 1))
+    feature.SetField('AcresPoly', acres)
+    feature.SetField('AcresDeed', acres * self.random.uniform(0.97, 1.03))
+    feature.SetField('UseType1', values['use'])
+    feature.SetField('MultiUseYN', 'N')
+    feature.SetField('HmstdYN', 'Y' if values['homestead'] else 'N')
+    feature.SetField('EMVLand', values['emv_land'])
+    feature.SetField('EMVBldg', values['emv_bldg'])
+    feature.SetField('EMVTotal', values['emv_total'])
+    feature.SetField('TaxCap', values['tax_capacity'])
+    feature.SetField('TotalTax', values['total_tax'])
+    feature.SetField('TaxExYN', 'Y' if values['use'] == 'Exempt' else 'N')
+    if values['year_built'] is not None:
+      feature.SetField('YearBuilt', values['year_built'])
+      feature.SetField('LivingSqFt', float(self.random.randint(700, 4000)))
+      feature.SetField('GarageYN', 'Y' if self.random.random() < 0.8 else 'N')
+      feature.SetField('BasementYN', 'Y' if self.random.random() < 0.7 else 'N')
+      feature.SetField('LivingUnit', '1')
+    if values['sale'] is not None:
+      feature.SetField('LastSale', '%04d/%02d/%02d' % values['sale'])
+      feature.SetField('SalePrice', values['sale_price'])
+    feature.SetField('SchDistNum', values['school'])
+    feature.SetField('WshdTax', values['watershed'])
+    feature.SetField('GrnAcresYN', 'N')
+    feature.SetField('OpenSpcYN', 'N')
+    feature.SetField('AgPYN', 'N')
+    return feature
+
+
+  def anoka_feature(self, feature, index, block, lot, ring, latitude, values):
+    """
+    Fill in an Anoka feature.
+    """
+    acres = self.ring_area(ring, latitude) * 0.000247105
+    feature.SetField('COUNTY_ID', '003')
+    feature.SetField('PIN', '%02d%02d%02d%07d' % (index % 36 + 1, 30 + (index // 36) % 4, 22 + (block % 4), index))
+    feature.SetField('BLDG_NUM', str(values['house_number']))
+    feature.SetField('PREFIX_DIR', values['direction'])
+    feature.SetField('STREETNAME', values['street'])
+    feature.SetField('STREETTYPE', values['street_type'])
+    feature.SetField('CITY', values['city'])
+    feature.SetField('CITY_USPS', values['city'])
+    feature.SetField('ZIP', values['zip'])
+    feature.SetField('PLAT_NAME', '%s ADDITION' % (values['street']))
+    feature.SetField('BLOCK', str(block % 1000 + 1))
+    feature.SetField('LOT', str(lot + 1))
+    feature.SetField('ACRES_POLY', acres)
+    feature.SetField('ACRES_DEED', acres * self.random.uniform(0.97, 1.03))
+    feature.SetField('USE1_DESC', values['use'])
+    feature.SetField('MULTI_USES', 'N')
+    feature.SetField('OWNER_NAME', values['owner'])
+    feature.SetField('HOMESTEAD', 'Y' if values['homestead'] else 'N')
+    feature.SetField('EMV_LAND', values['emv_land'])
+    feature.SetField('EMV_BLDG', values['emv_bldg'])
+    feature.SetField('EMV_TOTAL', values['emv_total'])
+    feature.SetField('TAX_CAPAC', values['tax_capacity'])
+    feature.SetField('TOTAL_TAX', values['total_tax'])
+    feature.SetField('TAX_EXEMPT', 'N')
+    if values['year_built'] is not None:
+      feature.SetField('YEAR_BUILT', values['year_built'])
+      feature.SetField('FIN_SQ_FT', float(self.random.randint(700, 4000)))
+      feature.SetField('NUM_UNITS', '1')
+    if values['sale'] is not None:
+      feature.SetField('SALE_DATE', '%04d/%02d/%02d' % values['sale'])
+      feature.SetField('SALE_VALUE', values['sale_price'])
+    feature.SetField('SCHOOL_DST', values['school'])
+    feature.SetField('WSHD_DIST', values['watershed'])
+    feature.SetField('GREEN_ACRE', 'N')
+    feature.SetField('OPEN_SPACE', 'N')
+    feature.SetField('AG_PRESERV', 'N')
+    return feature
+
+
+  def generate(self, county, count, output_path):
+    """
+    Write a synthetic shapefile for a county.
+    """
+    options = self.counties[county]
+    path = os.path.join(output_path, '%s-parcels.shp' % (county))
+    self.out('- Generating %s features for %s in %s\n' % (count, county, path))
+
+    if not os.path.exists(output_path):
+      os.makedirs(output_path)
+    if os.path.exists(path):
+      self.out_driver.DeleteDataSource(path)
+
+    # Seed per county so each county is reproducible on its own.
+    self.random = random.Random('%s-%s-%s' % (self.args.seed, county, count))
+
+    source = self.out_driver.CreateDataSource(path)
+    layer = source.CreateLayer('%s-parcels' % (county), self.spatial_reference, ogr.wkbPolygon)
+    for name, field_type, width, precision in options['fields']:
+      field = ogr.FieldDefn(name, field_type)
+      field.SetWidth(width)
+      field.SetPrecision(precision)
+      layer.CreateField(field)
+
+    definition = layer.GetLayerDefn()
+    make_feature = getattr(self, '%s_feature' % (county))
+    pins = set()
+    index = 0
+    for ring, latitude, block, lot in self.blocks(options['extent'], count):
+      feature = ogr.Feature(definition)
+      make_feature(feature, index, block, lot, ring, latitude, self.values(county))
+      pin = feature.GetField(options['pin_field'])
+      if pin in pins:
+        raise ValueError('Duplicate synthetic PIN for %s: %s' % (county, pin))
+      pins.add(pin)
+
+      geometry_ring = ogr.Geometry(ogr.wkbLinearRing)
+      for x, y in ring:
+        geometry_ring.AddPoint_2D(x, y)
+      geometry = ogr.Geometry(ogr.wkbPolygon)
+      geometry.AddGeometry(geometry_ring)
+      feature.SetGeometry(geometry)
+
+      layer.CreateFeature(feature)
+      index = index + 1
+
+    source.Destroy()
+
+
+  def process(self):
+    """
+    Main execution handler.
+    """
+    self.argparser = argparse.ArgumentParser(description = self.description, formatter_class = argparse.RawDescriptionHelpFormatter,)
+
+    self.argparser.add_argument(
+      '--size',
+      help = 'Number of features per county, for example 10k, 100k or 1M.',
+      default = '10k'
+    )
+
+    self.argparser.add_argument(
+      '--counties',
+      help = 'Comma separated list of counties to generate.',
+      default = 'hennepin,ramsey,anoka'
+    )
+
+    self.argparser.add_argument(
+      '--output',
+      help = 'Directory to write to; defaults to data/synthetic/<size>.',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--seed',
+      help = 'Random seed so that output is reproducible.',
+      default = '2014'
+    )
+
+    self.argparser.add_argument(
+      '--invalid-rate',
+      help = 'Fraction of parcels that get an invalid (self intersecting) geometry.',
+      type = float,
+      default = 0.001
+    )
+
+    # Parse options
+    self.args = self.argparser.parse_args()
+    self.invalid_rate = self.args.invalid_rate
+    count = self.parse_size(self.args.size)
+    output_path = self.args.output or os.path.join(self.default_output_path, self.args.size)
+
+    for county in self.args.counties.split(','):
+      if county not in self.counties:
+        self.error('Unknown county: %s\n' % (county))
+        sys.exit(1)
+
+      self.generate(county, count, output_path)
+
+
+# Handle execution
+if __name__ == '__main__':
+  sp = SyntheticParcels()
+  sp.process()
@@ -0,0 +1,457 @@
+"""
+Parts of processing parcels that do not need GDAL, kept here so that they
+can be tested without GDAL or the county data.
+"""
+
+
+import os, hashlib, heapq, itertools, json, mmap, pickle, shutil, struct, tempfile
+
+
+class Topology():
+  """
+  Builds TopoJSON topology from polygons.  Coordinates are quantized to a
+  grid, then rings are cut into arcs at junctions (points where the
+  neighboring points are not the same for every ring that uses them), so
+  that an edge shared by two parcels is one arc used forwards by one and
+  backwards (~index) by the other.
+
+  Points and their neighbors are sorted in runs on disk to find junctions,
+  and arcs are written to disk as they are cut with only a hash of each kept
+  to find shared ones.  Memory grows with the number of junctions and arcs,
+  not with the number of points.
+  """
+
+  def __init__(self, translate, scale, temp_path, chunk_size = 200000):
+    """
+    Constructor.  Runs and arcs are written to temp_path.
+    """
+    self.translate = translate
+    self.scale = scale
+    self.temp_path = temp_path
+    self.chunk_size = chunk_size
+    self.points = []
+    self.runs = []
+    self.junctions = set()
+    self.arc_count = 0
+    self.arc_indexes = {}
+    self.arc_file = open(os.path.join(temp_path, 'arcs.json'), 'w')
+
+
+  def transform(self):
+    """
+    TopoJSON transform.
+    """
+    return { 'scale': list(self.scale), 'translate': list(self.translate) }
+
+
+  def quantize(self, ring):
+    """
+    Quantize a ring, dropping repeated points.  Returns the ring without the
+    closing point, or None if it collapses.
+    """
+    tx, ty = self.translate
+    sx, sy = self.scale
+    quantized = []
+    for x, y in ring:
+      point = (int(round((x - tx) / sx)), int(round((y - ty) / sy)))
+      if len(quantized) == 0 or quantized[-1] != point:
+        quantized.append(point)
+
+    if len(quantized) > 1 and quantized[0] == quantized[-1]:
+      quantized.pop()
+    return quantized if len(quantized) >= 3 else None
+
+
+  def add_junctions(self, polygons):
+    """
+    Record the neighbors of each point of some polygons; see
+    find_junctions.
+    """
+    for polygon in polygons:
+      for ring in polygon:
+        ring = self.quantize(ring)
+        if ring is None:
+          continue
+
+        for i in range(0, len(ring)):
+          self.points.append((ring[i], tuple(sorted((ring[i - 1], ring[(i + 1) % len(ring)])))))
+        if len(self.points) >= self.chunk_size:
+          self.write_points()
+
+
+  def write_points(self):
+    """
+    Sort the points recorded so far and write them to disk as a run.
+    """
+    self.points.sort()
+    path = os.path.join(self.temp_path, 'points-%s.run' % (len(self.runs)))
+    file = open(path, 'wb')
+    for record in self.points:
+      pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+    file.close()
+    self.runs.append(path)
+    self.points = []
+
+
+  def read_points(self, path):
+    """
+    Read points back from a sorted run.
+    """
+    file = open(path, 'rb')
+    try:
+      while True:
+        yield pickle.load(file)
+    except EOFError:
+      pass
+    finally:
+      file.close()
+
+
+  def find_junctions(self):
+    """
+    Merge the sorted runs of points and mark the points that do not have
+    the same neighbors everywhere as junctions.
+    """
+    self.write_points()
+    merged = heapq.merge(*[self.read_points(run) for run in self.runs])
+    for point, records in itertools.groupby(merged, lambda r: r[0]):
+      pair = next(records)[1]
+      if any(r[1] != pair for r in records):
+        self.junctions.add(point)
+
+    for run in self.runs:
+      os.remove(run)
+    self.runs = []
+
+
+  def arc_hash(self, arc):
+    """
+    Short hash of the points of an arc.
+    """
+    return hashlib.sha1(struct.pack('<%sq' % (len(arc) * 2), *itertools.chain.from_iterable(arc))).digest()[0:8]
+
+
+  def arc_index(self, arc):
+    """
+    Index of an arc, adding it if it is new; ~index if it is an existing
+    arc backwards.  New arcs are delta encoded and written to disk.
+    """
+    forward = self.arc_hash(arc)
+    if forward in self.arc_indexes:
+      return self.arc_indexes[forward]
+
+    reverse = self.arc_hash(arc[::-1])
+    if reverse in self.arc_indexes:
+      return ~self.arc_indexes[reverse]
+
+    encoded = [list(arc[0])]
+    for i in range(1, len(arc)):
+      encoded.append([arc[i][0] - arc[i - 1][0], arc[i][1] - arc[i - 1][1]])
+    self.arc_file.write(json.dumps(encoded, separators = (',', ':')) + '\n')
+
+    self.arc_indexes[forward] = self.arc_count
+    self.arc_count = self.arc_count + 1
+    return self.arc_indexes[forward]
+
+
+  def ring_arcs(self, ring):
+    """
+    Cut a (quantized, open) ring into arcs at junctions.
+    """
+    cuts = [i for i in range(0, len(ring)) if ring[i] in self.junctions]
+
+    # Rings without junctions are one arc; start at the smallest point so
+    # the same ring is always the same arc.
+    if len(cuts) == 0:
+      start = ring.index(min(ring))
+      ring = ring[start:] + ring[:start]
+      return [self.arc_index(ring + [ring[0]])]
+
+    ring = ring[cuts[0]:] + ring[:cuts[0]] + [ring[cuts[0]]]
+    cuts = [i - cuts[0] for i in cuts] + [len(ring) - 1]
+    return [self.arc_index(ring[cuts[i]:cuts[i + 1] + 1]) for i in range(0, len(cuts) - 1)]
+
+
+  def geometry(self, polygons):
+    """
+    TopoJSON geometry object for some polygons.
+    """
+    arcs = []
+    for polygon in polygons:
+      rings = [self.quantize(ring) for ring in polygon]
+      if len(rings) == 0 or rings[0] is None:
+        continue
+      arcs.append([self.ring_arcs(ring) for ring in rings if ring is not None])
+
+    if len(arcs) == 0:
+      return { 'type': None }
+    if len(arcs) == 1:
+      return { 'type': 'Polygon', 'arcs': arcs[0] }
+    return { 'type': 'MultiPolygon', 'arcs': arcs }
+
+
+  def encoded_arcs(self):
+    """
+    Arcs, delta encoded, as JSON.
+    """
+    self.arc_file.close()
+    file = open(self.arc_file.name, 'r')
+    for line in file:
+      yield line.rstrip('\n')
+    file.close()
+
+
+class AttributeStore():
+  """
+  Reads an attribute store written by AttributeStoreWriter.  The store is
+  one file of columns, memory mapped so that looking up a parcel reads only
+  its values:
+
+    magic (8 bytes), header length (uint64), JSON header, padding to 8
+    float column: count doubles, NaN for null
+    string column: count + 1 uint64 offsets into the UTF-8 data, then data
+
+  All numbers are little endian and column offsets in the header are from
+  the end of the header padding.
+  """
+
+  magic = b'MPATTR1\n'
+
+
+  def __init__(self, path):
+    """
+    Constructor.
+    """
+    self.file = open(path, 'rb')
+    self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+    if self.map[0:8] != self.magic:
+      raise ValueError('Not an attribute store: %s' % (path))
+
+    header_length = struct.unpack_from('<Q', self.map, 8)[0]
+    self.header = json.loads(self.map[16:16 + header_length].decode('utf-8'))
+    self.base = AttributeStore.padded(16 + header_length)
+    self.count = self.header['count']
+    self.columns = self.header['columns']
+
+
+  @staticmethod
+  def padded(length):
+    """
+    Length rounded up to a multiple of 8.
+    """
+    return (length + 7) // 8 * 8
+
+
+  def __len__(self):
+    return self.count
+
+
+  def get(self, key):
+    """
+    Attributes for a parcel key as a dict, or None if there is no such key.
+    """
+    if key < 0 or key >= self.count:
+      return None
+
+    attributes = {}
+    for column in self.columns:
+      if column['type'] == 'float':
+        value = struct.unpack_from('<d', self.map, self.base + column['offset'] + key * 8)[0]
+        attributes[column['name']] = None if value != value else value
+      else:
+        start, end = struct.unpack_from('<QQ', self.map, self.base + column['offset'] + key * 8)
+        data = self.base + column['data']
+        attributes[column['name']] = self.map[data + start:data + end].decode('utf-8') if end > start else None
+    return attributes
+
+
+  def close(self):
+    """
+    Close the store.
+    """
+    self.map.close()
+    self.file.close()
+
+
+class AttributeStoreWriter():
+  """
+  Writes an attribute store (see AttributeStore) from rows added in key
+  order.  Each column is written to its own temporary file as rows are
+  added, then they are put together in one file.
+  """
+
+  def __init__(self, path, columns):
+    """
+    Constructor.  Columns are (name, type) where type is float or string.
+    """
+    self.path = path
+    self.columns = columns
+    self.count = 0
+    self.temp_path = tempfile.mkdtemp(prefix = 'metro-attributes-')
+    self.files = []
+    self.lengths = []
+    for i, (name, column_type) in enumerate(columns):
+      values = open(os.path.join(self.temp_path, '%s.values' % (i)), 'wb')
+      data = open(os.path.join(self.temp_path, '%s.data' % (i)), 'wb') if column_type == 'string' else None
+      if data is not None:
+        values.write(struct.pack('<Q', 0))
+      self.files.append((values, data))
+      self.lengths.append(0)
+
+
+  def add(self, key, values):
+    """
+    Add the values for a parcel key.  Keys that are skipped are left null.
+    """
+    if key < self.count:
+      raise ValueError('Parcel key %s is out of order; expected at least %s' % (key, self.count))
+    while self.count < key:
+      self.write_row([None] * len(self.columns))
+    self.write_row(values)
+
+
+  def write_row(self, values):
+    """
+    Write the next row.
+    """
+    for i, value in enumerate(values):
+      column_values, column_data = self.files[i]
+      if column_data is None:
+        column_values.write(struct.pack('<d', float('nan') if value is None else float(value)))
+        continue
+
+      if value is not None:
+        encoded = (value if isinstance(value, bytes) else ('%s' % (value)).encode('utf-8'))
+        column_data.write(encoded)
+        self.lengths[i] = self.lengths[i] + len(encoded)
+      column_values.write(struct.pack('<Q', self.lengths[i]))
+    self.count = self.count + 1
+
+
+  def close(self):
+    """
+    Put the columns together into the store.  The store is written next to
+    its path and moved into place so that readers never see part of it.
+    """
+    header = { 'count': self.count, 'columns': [] }
+    offset = 0
+    for i, (name, column_type) in enumerate(self.columns):
+      column_values, column_data = self.files[i]
+      column_values.close()
+      column = { 'name': name, 'type': column_type, 'offset': offset }
+      offset = offset + AttributeStore.padded(os.path.getsize(column_values.name))
+      if column_data is not None:
+        column_data.close()
+        column['data'] = offset
+        offset = offset + AttributeStore.padded(os.path.getsize(column_data.name))
+      header['columns'].append(column)
+
+    if not os.path.exists(os.path.dirname(os.path.abspath(self.path))):
+      os.makedirs(os.path.dirname(os.path.abspath(self.path)))
+
+    encoded = json.dumps(header, separators = (',', ':')).encode('utf-8')
+    temp_store = '%s.tmp' % (self.path)
+    with open(temp_store, 'wb') as store:
+      store.write(AttributeStore.magic)
+      store.write(struct.pack('<Q', len(encoded)))
+      store.write(encoded)
+      self.pad(store)
+      for column_values, column_data in self.files:
+        for column_file in [column_values, column_data]:
+          if column_file is None:
+            continue
+          with open(column_file.name, 'rb') as f:
+            shutil.copyfileobj(f, store)
+          self.pad(store)
+
+    os.rename(temp_store, self.path)
+    shutil.rmtree(self.temp_path)
+
+
+  def pad(self, store):
+    """
+    Pad the store to a multiple of 8 bytes.
+    """
+    store.write(b'\0' * (AttributeStore.padded(store.tell()) - store.tell()))
+
+
+def check_geometries(wkbs):
+  """
+  Check a list of geometries (as WKB) in bulk with Shapely.  Returns a list
+  with None for valid geometries and (repaired WKB, reason) for invalid
+  ones.  Repairs keep only the polygon parts; the WKB is None if there is
+  no area left, or if the WKB could not be read at all (for instance a ring
+  that is not closed).  This is a function so it can be run in other
+  processes.
+  """
+  import numpy
+  import shapely
+
+  results = [None] * len(wkbs)
+  if len(wkbs) == 0:
+    return results
+
+  # WKB that cannot be read becomes None instead of raising
+  geometries = shapely.from_wkb(numpy.array(wkbs, dtype = object), on_invalid = 'ignore')
+  missing = shapely.is_missing(geometries)
+  for i in numpy.nonzero(missing)[0]:
+    results[i] = (None, 'Unreadable geometry')
+
+  invalid = numpy.nonzero(~missing & ~shapely.is_valid(geometries))[0]
+  if len(invalid) == 0:
+    return results
+
+  reasons = shapely.is_valid_reason(geometries[invalid])
+  repaired = shapely.make_valid(geometries[invalid])
+  for i, reason, geometry in zip(invalid, reasons, repaired):
+    if geometry.geom_type not in ('Polygon', 'MultiPolygon'):
+      polygons = [p for p in shapely.get_parts(geometry) if p.geom_type in ('Polygon', 'MultiPolygon')]
+      geometry = shapely.union_all(polygons) if len(polygons) > 0 else None
+
+    wkb = shapely.to_wkb(geometry) if geometry is not None and not geometry.is_empty else None
+    results[i] = (wkb, reason)
+
+  return results
+
+
+def merge_join(old_records, new_records):
+  """
+  Merge join two sorted record streams, yielding (change, old, new).
+  Records with the same key are paired in order; extra ones are added or
+  removed.  Records without a PIN are never paired, since there is no
+  telling which old one is which new one.
+  """
+  old_groups = itertools.groupby(old_records, lambda r: r[0])
+  new_groups = itertools.groupby(new_records, lambda r: r[0])
+  old_key, old_group = next(old_groups, (None, None))
+  new_key, new_group = next(new_groups, (None, None))
+
+  while old_group is not None or new_group is not None:
+    if new_group is None or (old_group is not None and old_key < new_key):
+      for old in old_group:
+        yield 'removed', old, None
+      old_key, old_group = next(old_groups, (None, None))
+    elif old_group is None or new_key < old_key:
+      for new in new_group:
+        yield 'added', None, new
+      new_key, new_group = next(new_groups, (None, None))
+    else:
+      # Streamed, since every parcel without a PIN in a county has the
+      # same key
+      if not old_key[1]:
+        for old in old_group:
+          yield 'removed', old, None
+        for new in new_group:
+          yield 'added', None, new
+      else:
+        olds = list(old_group)
+        news = list(new_group)
+        paired = min(len(olds), len(news))
+        for i in range(0, paired):
+          yield 'changed', olds[i], news[i]
+        for old in olds[paired:]:
+          yield 'removed', old, None
+        for new in news[paired:]:
+          yield 'added', None, new
+      old_key, old_group = next(old_groups, (None, None))
+      new_key, new_group = next(new_groups, (None, None))
@@ -6,10 +6,22 @@ http://www.sos.state.mn.us/index.aspx?page=1630
 """
 
 
-import logging, os, sys, argparse
-import progressbar
-import numpy
+import logging, os, sys, argparse, csv, datetime, hashlib, heapq, itertools, json, math, pickle, re, shutil, sqlite3, tempfile, time
+from xml.sax.saxutils import escape
 from osgeo import ogr, osr
+from parcel_tools import Topology, AttributeStore, AttributeStoreWriter, check_geometries, merge_join
+
+
+class SourceError(Exception):
+  """
+  A source shapefile could not be opened.
+  """
+
+
+class OptionError(Exception):
+  """
+  An option, like an extract format, field or filter, cannot be used.
+  """
 
 
 class MetroParcels():
@@ -28,44 +40,113 @@ class MetroParcels():
   source_shape_dakota = os.path.join(script_path, '../data/reprojected_4326-shps/dakota-parcels.shp')
   source_shape_combined = os.path.join(script_path, '../data/combined-shp/metro-combined.shp')
 
+  # Counties that are combined; each has a source_shape_<county> path and a
+  # <county>_translation method.
+  counties = ['hennepin', 'ramsey', 'anoka']
+  county_ids = { 'hennepin': '27', 'ramsey': '62', 'anoka': '2' }
+
+  # Shapefile components (.shp and .dbf) cannot be bigger than 2 GB, so the
+  # combined output is split into shards a bit before that and stitched
+  # together with a VRT.  Shards can be split by size or one (or more) per
+  # county.
+  shard_by = 'size'
+  shard_max_bytes = 2000000000
+  processes = 1
+
+  # Diffing two years of combined output.  Records are sorted in chunks of
+  # this many on disk, which bounds how much is in memory.
+  diff_output = os.path.join(script_path, '../data/combined-shp/metro-changes.shp')
+  diff_fields = ['COUNTY_ID', 'PIN', 'EMV_TOTAL', 'SALE_DATE', 'SALE_VALUE']
+  sort_chunk_size = 200000
+
+  # Geometry validation and repair.  Results are cached by geometry hash
+  # so unchanged parcels are not checked again on the next release.
+  validate = False
+  validate_chunk_size = 10000
+  validate_processes = 1
+  validation_cache = os.path.join(script_path, '../data/combined-shp/geometry-cache.sqlite')
+  validation_report = os.path.join(script_path, '../data/combined-shp/repaired-geometries.csv')
+
+  # Drivers for extracts by file extension
+  extract_drivers = {
+    '.geojson': 'GeoJSON',
+    '.json': 'GeoJSON',
+    '.geojsonl': 'GeoJSONSeq',
+    '.geojsons': 'GeoJSONSeq',
+    '.gpkg': 'GPKG',
+    '.shp': 'ESRI Shapefile'
+  }
+
+  # TopoJSON extracts are quantized to the size of a pixel at this zoom.
+  topojson_zoom = 16
+
+  # Counties are combined in this order, which is also the order parcel
+  # keys are numbered in.
+  combine_order = ['ramsey', 'anoka', 'hennepin']
+
+  # Attributes for map interactivity are kept in a store looked up by
+  # PARCEL_KEY, so that UTFGrid tiles only need to carry the key.
+  attribute_store = os.path.join(script_path, '../data/combined-shp/metro-attributes.bin')
+  attribute_fields = ['COUNTY_ID', 'PIN', 'EMV_TOTAL', 'EMV_LAND', 'EMV_BLDG', 'ACRES_POLY', 'ACRES_DEED', 'USE1_DESC', 'HOMESTEAD']
+  attribute_port = 8805
+
+  # The store is also published next to the app as static JSONP chunks of
+  # this many parcels; this has to match attributesChunkSize in js/app.js.
+  attribute_chunks = os.path.join(script_path, '../data/attributes')
+  attribute_chunk_size = 1000
+
 
   def __init__(self):
     """
-    Constructor.
+    Constructor.  Sources are opened as they are used, so nothing is read
+    until a command needs it.
     """
     self.in_driver = ogr.GetDriverByName('ESRI Shapefile')
     self.out_driver = ogr.GetDriverByName('ESRI Shapefile')
+    self.opened = []
 
-    # Read files
-    self.shape_hennepin = self.in_driver.Open(self.source_shape_hennepin, 0)
-    self.shape_anoka = self.in_driver.Open(self.source_shape_anoka, 0)
-    self.shape_ramsey = self.in_driver.Open(self.source_shape_ramsey, 0)
-    if self.shape_hennepin is None or self.shape_anoka is None or self.shape_ramsey is None:
-      self.error('Could not find a necessary shapefile')
-      sys.exit(1)
 
-    # Get actual layers
-    self.hennepin = self.shape_hennepin.GetLayer()
-    self.anoka = self.shape_anoka.GetLayer()
-    self.ramsey = self.shape_ramsey.GetLayer()
+  def __getattr__(self, name):
+    """
+    Open a county source the first time its layer or layer definition is
+    asked for, for example self.ramsey or self.ramsey_definition.
+    """
+    county = name[:-len('_definition')] if name.endswith('_definition') else name
+    if county not in self.counties:
+      raise AttributeError(name)
 
-    # Get layer definitions (no need to do this more than once)
-    self.hennepin_definition = self.hennepin.GetLayerDefn()
-    self.anoka_definition = self.anoka.GetLayerDefn()
-    self.ramsey_definition = self.ramsey.GetLayerDefn()
+    self.open_source(county)
+    return self.__dict__[name]
 
-    # Start pocessing
-    self.process()
+
+  def open_source(self, county):
+    """
+    Open a county shapefile and get its layer and layer definition.  Raises
+    SourceError if it cannot be opened.
+    """
+    path = getattr(self, 'source_shape_%s' % (county))
+    shape = self.in_driver.Open(path, 0)
+    if shape is None:
+      raise SourceError('Could not find a necessary shapefile: %s' % (path))
+
+    layer = shape.GetLayer()
+    setattr(self, 'shape_%s' % (county), shape)
+    setattr(self, county, layer)
+    setattr(self, '%s_definition' % (county), layer.GetLayerDefn())
+    self.opened.append(county)
 
 
   def close(self):
     """
     Close out data sources
     """
-    self.shape_hennepin.Destroy()
-    self.shape_anoka.Destroy()
-    self.shape_ramsey.Destroy()
-    self.shape_combined.Destroy()
+    for county in self.opened:
+      getattr(self, 'shape_%s' % (county)).Destroy()
+    self.opened = []
+
+    if self.__dict__.get('shape_combined') is not None:
+      self.shape_combined.Destroy()
+      self.shape_combined = None
 
 
   def out(self, message):
@@ -128,33 +209,324 @@ class MetroParcels():
     """
     Adds field definitions to shapes.  We know Anoka has the fields we want.
     http://www.datafinder.org/metadata/ParcelsCurrent.html#Entity_and_Attribute_Information
+
+    If there is a manifest from a previous run, it is opened so that all
+    the shards are read as one layer.  Opening to read (neither removing
+    nor creating fields) raises SourceError if there is no combined output.
     """
     self.out('- Creating combined layer.\n')
 
     # Create layer to write to
     if not os.path.exists(os.path.dirname(self.source_shape_combined)):
       os.makedirs(os.path.dirname(self.source_shape_combined))
-    if os.path.exists(self.source_shape_combined) and remove_old:
-      self.out_driver.DeleteDataSource(self.source_shape_combined)
+    if remove_old:
+      self.remove_combined()
 
-    # Open or create combined
-    if os.path.exists(self.source_shape_combined):
+    # Open existing or set up shards to write to
+    if os.path.exists(self.combined_manifest()):
+      self.shape_combined = ogr.Open(self.combined_manifest(), 0)
+      self.combined = self.shape_combined.GetLayer()
+      self.combined_definition = self.combined.GetLayerDefn()
+    elif os.path.exists(self.source_shape_combined):
       self.shape_combined = self.out_driver.Open(self.source_shape_combined, 1)
       self.combined = self.shape_combined.GetLayer()
+
+      # Create field definition from anoka
+      if create_fields:
+        for i in range(0, self.anoka_definition.GetFieldCount()):
+          self.combined.CreateField(self.anoka_definition.GetFieldDefn(i))
+
+      self.combined_definition = self.combined.GetLayerDefn()
+    elif not remove_old and not create_fields:
+      raise SourceError('There is no combined output at %s; combine first.' % (self.combined_manifest()))
     else:
-      self.shape_combined = self.out_driver.CreateDataSource(self.source_shape_combined)
-      self.combined = self.shape_combined.CreateLayer('metro_parcels', geom_type = ogr.wkbPolygon)
+      self.start_shards(create_fields)
+
+
+  def start_shards(self, create_fields = True):
+    """
+    Set up to write shards.  Shards are created as features are written;
+    see reserve_shard.
+    """
+    self.combined_fields = []
 
     # Create field definition from anoka
     if create_fields:
       for i in range(0, self.anoka_definition.GetFieldCount()):
-        field = self.anoka_definition.GetFieldDefn(i)
-        self.combined.CreateField(field)
+        self.combined_fields.append(self.anoka_definition.GetFieldDefn(i))
 
     # Create other fields here
+    if create_fields:
+      parcel_key = ogr.FieldDefn('PARCEL_KEY', ogr.OFTInteger)
+      parcel_key.SetWidth(10)
+      self.combined_fields.append(parcel_key)
+    self.parcel_keys = create_fields
+    self.next_parcel_key = 0
+
+    self.shards = []
+    self.shard_counts = {}
+    self.shard_county = None
+    self.shape_combined = None
+
+    # Writing by size only needs spatially ordered features if it is going
+    # to be split.
+    self.spatially_ordered = self.shard_by == 'size' and max(self.predicted_size()) > self.shard_max_bytes
+
+
+  def combined_manifest(self):
+    """
+    Path to the VRT that stitches shards together.
+    """
+    return self.source_shape_combined.replace('.shp', '.vrt')
 
+
+  def shard_path(self, name):
+    """
+    Path to a shard.  The first size based shard is the plain combined path.
+    """
+    if name is None:
+      return self.source_shape_combined
+    return self.source_shape_combined.replace('.shp', '-%s.shp' % (name))
+
+
+  def remove_combined(self):
+    """
+    Remove combined output and any shards listed in the manifest.
+    """
+    paths = [self.source_shape_combined] + self.combined_shards()
+    if os.path.exists(self.combined_manifest()):
+      os.remove(self.combined_manifest())
+
+    for path in paths:
+      if os.path.exists(path):
+        self.out_driver.DeleteDataSource(path)
+
+
+  def combined_shards(self):
+    """
+    Paths of existing combined shards, from the manifest if there is one.
+    """
+    import xml.etree.ElementTree as ElementTree
+
+    manifest = self.combined_manifest()
+    if not os.path.exists(manifest):
+      return [self.source_shape_combined] if os.path.exists(self.source_shape_combined) else []
+
+    return [os.path.join(os.path.dirname(manifest), source.text)
+      for source in ElementTree.parse(manifest).iter('SrcDataSource')]
+
+
+  def predicted_size(self):
+    """
+    Predict the size of the combined .shp and .dbf.  Geometries are copied
+    as is, so the .shp is about the size of the sources together, and .dbf
+    records are a fixed size.
+    """
+    shp_bytes = 100
+    features = 0
+    for county in self.counties:
+      shp_bytes = shp_bytes + os.path.getsize(getattr(self, 'source_shape_%s' % (county))) - 100
+      features = features + getattr(self, county).GetFeatureCount()
+
+    dbf_bytes = self.dbf_header_size() + (features * self.dbf_record_size())
+    return shp_bytes, dbf_bytes
+
+
+  def dbf_field_width(self, field):
+    """
+    Width of a field in a .dbf record.
+    """
+    if field.GetType() == ogr.OFTDate:
+      return 8
+    if field.GetWidth() > 0:
+      return field.GetWidth()
+    return { ogr.OFTInteger: 10, ogr.OFTReal: 24 }.get(field.GetType(), 80)
+
+
+  def dbf_header_size(self):
+    """
+    Size of .dbf header and end of file marker.
+    """
+    return 32 + (32 * len(self.combined_fields)) + 1 + 1
+
+
+  def dbf_record_size(self):
+    """
+    Size of a .dbf record, including the deleted flag.
+    """
+    return 1 + sum(self.dbf_field_width(f) for f in self.combined_fields)
+
+
+  def shp_record_size(self, geometry):
+    """
+    Size of a polygon record in a .shp, including the record header.
+    """
+    if geometry is None:
+      return 8 + 4
+
+    if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbMultiPolygon:
+      polygons = [geometry.GetGeometryRef(i) for i in range(0, geometry.GetGeometryCount())]
+    else:
+      polygons = [geometry]
+
+    parts = 0
+    points = 0
+    for polygon in polygons:
+      for i in range(0, polygon.GetGeometryCount()):
+        parts = parts + 1
+        points = points + polygon.GetGeometryRef(i).GetPointCount()
+
+    return 8 + 44 + (4 * parts) + (16 * points)
+
+
+  def open_shard(self, county):
+    """
+    Close the current shard and start a new one.
+    """
+    if self.shape_combined is not None:
+      self.shape_combined.Destroy()
+
+    # Name the shard
+    count = self.shard_counts.get(county if self.shard_by == 'county' else None, 0)
+    if self.shard_by == 'county':
+      name = county if count == 0 else '%s-%s' % (county, count + 1)
+      self.shard_counts[county] = count + 1
+    else:
+      name = None if count == 0 else str(count + 1)
+      self.shard_counts[None] = count + 1
+
+    path = self.shard_path(name)
+    if os.path.exists(path):
+      self.out_driver.DeleteDataSource(path)
+
+    self.shape_combined = self.out_driver.CreateDataSource(path)
+    self.combined = self.shape_combined.CreateLayer('metro_parcels', geom_type = ogr.wkbPolygon)
+    for field in self.combined_fields:
+      self.combined.CreateField(field)
     self.combined_definition = self.combined.GetLayerDefn()
 
+    self.shards.append(path)
+    self.shard_county = county
+    self.shard_shp_bytes = 100
+    self.shard_dbf_bytes = self.dbf_header_size()
+    self.shard_dbf_record_bytes = self.dbf_record_size()
+
+
+  def reserve_shard(self, county, geometry):
+    """
+    Make sure the current shard has room for a feature, starting a new
+    shard if it does not (or if it is for another county).
+    """
+    shp_bytes = self.shp_record_size(geometry)
+    if (self.shape_combined is None
+        or (self.shard_by == 'county' and self.shard_county != county)
+        or self.shard_shp_bytes + shp_bytes > self.shard_max_bytes
+        or self.shard_dbf_bytes + self.shard_dbf_record_bytes > self.shard_max_bytes):
+      self.open_shard(county)
+
+    self.shard_shp_bytes = self.shard_shp_bytes + shp_bytes
+    self.shard_dbf_bytes = self.shard_dbf_bytes + self.shard_dbf_record_bytes
+
+
+  def spatial_order(self, layer):
+    """
+    Feature IDs of a layer in Z-order (Morton order) of their envelope
+    centers, so that splitting a layer by size keeps shards spatially
+    together.
+    """
+    minx, maxx, miny, maxy = layer.GetExtent()
+    width = (maxx - minx) or 1
+    height = (maxy - miny) or 1
+
+    def spread(n):
+      n = n & 0xffff
+      n = (n | (n << 8)) & 0x00ff00ff
+      n = (n | (n << 4)) & 0x0f0f0f0f
+      n = (n | (n << 2)) & 0x33333333
+      return (n | (n << 1)) & 0x55555555
+
+    # Only geometries are needed
+    definition = layer.GetLayerDefn()
+    layer.SetIgnoredFields([definition.GetFieldDefn(i).GetNameRef() for i in range(0, definition.GetFieldCount())])
+
+    keys = []
+    for feature in layer:
+      geometry = feature.GetGeometryRef()
+      key = 0
+      if geometry is not None:
+        envelope = geometry.GetEnvelope()
+        x = int(((envelope[0] + envelope[1]) / 2.0 - minx) / width * 0xffff)
+        y = int(((envelope[2] + envelope[3]) / 2.0 - miny) / height * 0xffff)
+        key = spread(x) | (spread(y) << 1)
+      keys.append((key << 32) | feature.GetFID())
+
+    layer.ResetReading()
+    layer.SetIgnoredFields([])
+    keys.sort()
+    return [k & 0xffffffff for k in keys]
+
+
+  def finish_combined(self):
+    """
+    Close the last shard, add spatial references, and write the manifest.
+    """
+    if self.shape_combined is not None:
+      self.shape_combined.Destroy()
+      self.shape_combined = None
+
+    for path in self.shards:
+      self.make_spatial_reference(path)
+    self.write_manifest()
+
+    if len(self.shards) > 1:
+      self.out('- Combined output is in %s shards; read them as one layer with %s (layer metro_parcels).\n' % (len(self.shards), self.combined_manifest()))
+
+
+  def write_manifest(self):
+    """
+    Write a VRT that stitches the shards together into one layer.
+    """
+    manifest = self.combined_manifest()
+    lines = ['<OGRVRTDataSource>', '  <OGRVRTUnionLayer name="metro_parcels">']
+    for path in self.shards:
+      name = os.path.splitext(os.path.basename(path))[0]
+      lines.append('    <OGRVRTLayer name="%s">' % (escape(name)))
+      lines.append('      <SrcDataSource relativeToVRT="1">%s</SrcDataSource>' % (escape(os.path.basename(path))))
+      lines.append('    </OGRVRTLayer>')
+    lines.append('    <FieldStrategy>FirstLayer</FieldStrategy>')
+    lines.append('  </OGRVRTUnionLayer>')
+    lines.append('</OGRVRTDataSource>')
+
+    file = open(manifest, 'w')
+    file.write('\n'.join(lines) + '\n')
+    file.close()
+
+
+  def shard_options(self):
+    """
+    Settings needed to combine a county in another process.
+    """
+    options = { 'source_shape_combined': self.source_shape_combined, 'shard_by': self.shard_by, 'shard_max_bytes': self.shard_max_bytes }
+    for county in self.counties:
+      options['source_shape_%s' % (county)] = getattr(self, 'source_shape_%s' % (county))
+      options['%s_count' % (county)] = getattr(self, '%s_count' % (county))
+    return options
+
+
+  def combine_parallel(self, counties):
+    """
+    Combine counties into their own shards at the same time.
+    """
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(self.processes, len(counties)))
+    results = pool.map(combine_county_shards, [(county, self.shard_options()) for county in counties])
+    pool.close()
+    pool.join()
+
+    for shards in results:
+      self.shards.extend(shards)
+
 
   def hennepin_translation(self, old, new):
     """
@@ -548,8 +920,9 @@ class MetroParcels():
     """
     Translation layer for each feature for Anoka.
     """
-    # Figure out number of fields
-    field_count = self.combined_definition.GetFieldCount()
+    # Figure out number of fields; the combined output has some of its own
+    # after these
+    field_count = self.anoka_definition.GetFieldCount()
 
     # Add field values from input Layer
     for i in range(0, field_count):
@@ -565,49 +938,191 @@ class MetroParcels():
     """
     Combine layer.
     """
+    import progressbar
+
     layer = getattr(self, layer_name)
     layer_count = getattr(self, '%s_count' % (layer_name))
-    layer_translation = getattr(self, '%s_translation' % (layer_name))
 
     # Progress bar
     widgets = ['- Combining %s features of %s: ' % (layer_count, layer_name), progressbar.Percentage(), ' ', progressbar.Bar(), ' ', progressbar.ETA()]
     progress = progressbar.ProgressBar(widgets = widgets, maxval = layer_count).start()
     completed = 0
 
-    # Add features to the ouput Layer
-    for i in range(0, layer_count):
-      existing_feature = layer.GetFeature(i)
-      combined_feature = ogr.Feature(self.combined_definition)
+    # Read in spatial order if this is going to be split by size
+    order = self.spatial_order(layer) if self.spatially_ordered else range(0, layer_count)
 
-      # Translate
-      combined_feature = layer_translation(existing_feature, combined_feature)
+    # Parcel keys follow on from the counties combined before this one, so
+    # they are the same whether combined in parallel or not
+    previous = self.combine_order[:self.combine_order.index(layer_name)]
+    self.next_parcel_key = sum(getattr(self, '%s_count' % (c)) for c in previous)
 
-      # Set geometry
-      combined_feature.SetGeometry(existing_feature.GetGeometryRef())
-
-      # Add new feature to output Layer
-      self.combined.CreateFeature(combined_feature)
-
-      # Save changes
-      self.combined.SyncToDisk()
+    # Add features to the ouput Layer.  If validating, features are
+    # collected and their geometries checked in chunks.
+    pending = []
+    for i in order:
+      existing_feature = layer.GetFeature(i)
+      if self.validate:
+        pending.append(existing_feature)
+        if len(pending) >= self.validate_chunk_size:
+          self.write_validated_features(layer_name, pending)
+          pending = []
+      else:
+        self.write_feature(layer_name, existing_feature, existing_feature.GetGeometryRef())
 
       # Update progress
       completed = completed + 1
       progress.update(completed)
 
+    if len(pending) > 0:
+      self.write_validated_features(layer_name, pending)
+
     # Stop progress bar
     progress.finish()
 
 
-  def make_spatial_reference(self):
+  def write_feature(self, layer_name, existing_feature, geometry):
+    """
+    Translate a feature and write it to the combined output.
+    """
+    layer_translation = getattr(self, '%s_translation' % (layer_name))
+    self.reserve_shard(layer_name, geometry)
+    combined_feature = ogr.Feature(self.combined_definition)
+
+    # Translate
+    combined_feature = layer_translation(existing_feature, combined_feature)
+    if self.parcel_keys:
+      combined_feature.SetField('PARCEL_KEY', self.next_parcel_key)
+      self.next_parcel_key = self.next_parcel_key + 1
+
+    # Set geometry
+    combined_feature.SetGeometry(geometry)
+
+    # Add new feature to output Layer
+    self.combined.CreateFeature(combined_feature)
+
+    # Save changes
+    self.combined.SyncToDisk()
+    return combined_feature
+
+
+  def write_validated_features(self, layer_name, features):
+    """
+    Validate (and repair) the geometries of a chunk of features, then write
+    them.
+    """
+    geometries = [f.GetGeometryRef() for f in features]
+    repaired = self.validate_geometries([bytes(g.ExportToWkb()) if g is not None else None for g in geometries])
+
+    for i in range(0, len(features)):
+      if i not in repaired:
+        self.write_feature(layer_name, features[i], geometries[i])
+        continue
+
+      # Parcels with no area left, or that could not be read, are kept
+      # without a geometry so that their attributes (and parcel key) are
+      # still there
+      wkb, reason = repaired[i]
+      combined_feature = self.write_feature(layer_name, features[i], ogr.CreateGeometryFromWkb(wkb) if wkb is not None else None)
+      self.validation_writer.writerow([combined_feature.GetField('COUNTY_ID'), combined_feature.GetField('PIN'), reason,
+        'repaired' if wkb is not None else 'geometry nulled'])
+      self.validation_counts['repaired'] = self.validation_counts['repaired'] + 1
+
+
+  def geometry_hash(self, wkb):
+    """
+    Hash of a geometry's WKB.
+    """
+    return hashlib.sha1(wkb).hexdigest() if wkb is not None else None
+
+
+  def start_validation(self):
+    """
+    Open the validation cache and report, and processes to check in.
+    """
+    if not os.path.exists(os.path.dirname(self.validation_cache)):
+      os.makedirs(os.path.dirname(self.validation_cache))
+
+    self.validation_database = sqlite3.connect(self.validation_cache)
+    self.validation_database.execute('CREATE TABLE IF NOT EXISTS geometries (hash TEXT PRIMARY KEY, repaired BLOB, reason TEXT)')
+    self.validation_file = open(self.validation_report, 'w')
+    self.validation_writer = csv.writer(self.validation_file)
+    self.validation_writer.writerow(['COUNTY_ID', 'PIN', 'REASON', 'ACTION'])
+    self.validation_counts = { 'checked': 0, 'cached': 0, 'repaired': 0 }
+
+    self.validation_pool = None
+    if self.validate_processes > 1:
+      import multiprocessing
+      self.validation_pool = multiprocessing.Pool(self.validate_processes)
+
+
+  def finish_validation(self):
+    """
+    Close the validation cache and report.
+    """
+    if self.validation_pool is not None:
+      self.validation_pool.close()
+      self.validation_pool.join()
+    self.validation_database.close()
+    self.validation_file.close()
+    self.out('- Checked %s geometries (%s more were cached); %s were repaired, see %s.\n' % (
+      self.validation_counts['checked'], self.validation_counts['cached'], self.validation_counts['repaired'], self.validation_report))
+
+
+  def validate_geometries(self, wkbs):
+    """
+    Validate a chunk of geometries, as WKB.  Geometries that have been
+    checked before are looked up in the cache, the rest are checked in bulk
+    (split across processes if there are more than one).  Returns a dict of
+    index to (repaired WKB, reason) for ones that were invalid.
+    """
+    hashes = [self.geometry_hash(w) for w in wkbs]
+
+    # Look up in cache; SQLite limits the number of parameters
+    known = {}
+    unique = list(set(h for h in hashes if h is not None))
+    for i in range(0, len(unique), 500):
+      batch = unique[i:i + 500]
+      rows = self.validation_database.execute('SELECT hash, repaired, reason FROM geometries WHERE hash IN (%s)' % (', '.join('?' * len(batch))), batch)
+      for h, repaired, reason in rows:
+        known[h] = (bytes(repaired) if repaired is not None else None, reason)
+
+    # Check the rest
+    unknown = [i for i in range(0, len(wkbs)) if hashes[i] is not None and hashes[i] not in known]
+    unknown_wkbs = [wkbs[i] for i in unknown]
+    if self.validation_pool is not None:
+      size = max(1, -(-len(unknown_wkbs) // self.validate_processes))
+      results = list(itertools.chain(*self.validation_pool.map(check_geometries, [unknown_wkbs[i:i + size] for i in range(0, len(unknown_wkbs), size)])))
+    else:
+      results = check_geometries(unknown_wkbs)
+
+    rows = []
+    for i, result in zip(unknown, results):
+      known[hashes[i]] = result if result is not None else (None, None)
+      rows.append((hashes[i], sqlite3.Binary(result[0]) if result is not None and result[0] is not None else None, result[1] if result is not None else None))
+    self.validation_database.executemany('INSERT OR REPLACE INTO geometries (hash, repaired, reason) VALUES (?, ?, ?)', rows)
+    self.validation_database.commit()
+
+    self.validation_counts['checked'] = self.validation_counts['checked'] + len(unknown)
+    self.validation_counts['cached'] = self.validation_counts['cached'] + len(wkbs) - len(unknown)
+
+    # Invalid ones have a reason
+    repaired = {}
+    for i in range(0, len(wkbs)):
+      if hashes[i] is not None and known[hashes[i]][1] is not None:
+        repaired[i] = known[hashes[i]]
+    return repaired
+
+
+  def make_spatial_reference(self, path = None):
     """
     Export out the spatial reference file.
     """
-    self.out('- Making spatial reference.\n')
+    path = path or self.source_shape_combined
+    self.out('- Making spatial reference for %s.\n' % (os.path.basename(path)))
     self.spatial_reference = osr.SpatialReference()
     self.spatial_reference.ImportFromEPSG(4326)
     self.spatial_reference.MorphToESRI()
-    file = open(self.source_shape_combined.replace('.shp', '.prj'), 'w')
+    file = open(path.replace('.shp', '.prj'), 'w')
     file.write(self.spatial_reference.ExportToWkt())
     file.close()
 
@@ -657,6 +1172,8 @@ class MetroParcels():
     """
     Outputs field values for a field.
     """
+    import progressbar
+
     found = {}
     count = self.combined.GetFeatureCount()
     widgets = ['- Finding values for %s: ' % (field_name), progressbar.Percentage(), ' ', progressbar.ETA()]
@@ -684,6 +1201,9 @@ class MetroParcels():
     """
     Gets some basic stats for certain groups.
     """
+    import progressbar
+    import numpy
+
     found = []
     count = self.combined.GetFeatureCount()
     widgets = ['- Gathering data stats on "%s": ' % (stat), progressbar.Percentage(), ' ', progressbar.ETA()]
@@ -736,9 +1256,553 @@ class MetroParcels():
       #[EMV_TOTAL > 1000000]  { polygon-fill: @level8; }
 
 
-  def process(self):
+  def diff(self, old_path, new_path, output_path):
     """
-    Main execution handler.
+    Find changes between two combined outputs (.shp or the .vrt of a sharded
+    output), for instance from different years.  Both are sorted by county
+    and PIN on disk and then merge joined, so memory use does not depend on
+    the size of the data.  Parcels that are only in one are added or
+    removed (splits show up as a removed parcel and new ones).
+    """
+    temp_path = tempfile.mkdtemp(prefix = 'metro-parcels-diff-')
+    try:
+      old_records = self.sorted_records(old_path, temp_path, 'old')
+      new_records = self.sorted_records(new_path, temp_path, 'new')
+      self.define_changes(output_path)
+
+      counts = { 'added': 0, 'removed': 0, 'changed': 0 }
+      for change, old, new in merge_join(old_records, new_records):
+        if self.write_change(change, old, new):
+          counts[change] = counts[change] + 1
+
+      self.shape_changes.Destroy()
+      self.make_spatial_reference(output_path)
+    finally:
+      shutil.rmtree(temp_path)
+
+    self.out('- Changes written to %s: %s added, %s removed, %s changed.\n' % (output_path, counts['added'], counts['removed'], counts['changed']))
+
+
+  def sorted_records(self, path, temp_path, name):
+    """
+    Read records to diff from a combined output and sort them by county and
+    PIN.  Chunks are sorted in memory and written to disk as runs, which are
+    then lazily merged.  Records are ((county, pin), sequence, values,
+    geometry hash, geometry WKB); the sequence keeps the sort stable and
+    means values are never compared.
+    """
+    import progressbar
+
+    source = ogr.Open(path, 0)
+    if source is None:
+      raise SourceError('Could not open %s' % (path))
+
+    # Only read the fields that are compared
+    layer = source.GetLayer()
+    definition = layer.GetLayerDefn()
+    layer.SetIgnoredFields([definition.GetFieldDefn(i).GetNameRef()
+      for i in range(0, definition.GetFieldCount())
+      if definition.GetFieldDefn(i).GetNameRef() not in self.diff_fields])
+
+    count = layer.GetFeatureCount()
+    widgets = ['- Sorting %s features of %s: ' % (count, path), progressbar.Percentage(), ' ', progressbar.ETA()]
+    progress = progressbar.ProgressBar(widgets = widgets, maxval = count).start()
+    completed = 0
+
+    runs = []
+    chunk = []
+    for feature in layer:
+      geometry = feature.GetGeometryRef()
+      wkb = bytes(geometry.ExportToWkb()) if geometry is not None else None
+      chunk.append((
+        (feature.GetField('COUNTY_ID') or '', feature.GetField('PIN') or ''),
+        completed,
+        (feature.GetField('EMV_TOTAL'), feature.GetField('SALE_DATE'), feature.GetField('SALE_VALUE')),
+        self.geometry_hash(wkb),
+        wkb
+      ))
+
+      if len(chunk) >= self.sort_chunk_size:
+        runs.append(self.write_run(chunk, temp_path, '%s-%s' % (name, len(runs))))
+        chunk = []
+
+      completed = completed + 1
+      progress.update(completed)
+
+    runs.append(self.write_run(chunk, temp_path, '%s-%s' % (name, len(runs))))
+    progress.finish()
+    source.Destroy()
+
+    return heapq.merge(*[self.read_run(run) for run in runs])
+
+
+  def write_run(self, chunk, temp_path, name):
+    """
+    Sort a chunk of records and write it to disk.
+    """
+    chunk.sort()
+    path = os.path.join(temp_path, '%s.run' % (name))
+    file = open(path, 'wb')
+    for record in chunk:
+      pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+    file.close()
+    return path
+
+
+  def read_run(self, path):
+    """
+    Read records back from a sorted run.
+    """
+    file = open(path, 'rb')
+    try:
+      while True:
+        yield pickle.load(file)
+    except EOFError:
+      pass
+    finally:
+      file.close()
+
+
+  def define_changes(self, output_path):
+    """
+    Create the change layer.
+    """
+    if not os.path.exists(os.path.dirname(output_path)):
+      os.makedirs(os.path.dirname(output_path))
+    if os.path.exists(output_path):
+      self.out_driver.DeleteDataSource(output_path)
+
+    self.shape_changes = self.out_driver.CreateDataSource(output_path)
+    self.changes = self.shape_changes.CreateLayer('metro_changes', geom_type = ogr.wkbPolygon)
+    fields = [
+      ('COUNTY_ID', ogr.OFTString, 3, 0),
+      ('PIN', ogr.OFTString, 17, 0),
+      ('CHANGE', ogr.OFTString, 7, 0),
+      ('EMV_OLD', ogr.OFTReal, 11, 0),
+      ('EMV_NEW', ogr.OFTReal, 11, 0),
+      ('EMV_DELTA', ogr.OFTReal, 11, 0),
+      ('SALE_OLD', ogr.OFTDate, 10, 0),
+      ('SALE_NEW', ogr.OFTDate, 10, 0),
+      ('SALE_D_DLT', ogr.OFTInteger, 6, 0),
+      ('SALE_V_OLD', ogr.OFTReal, 11, 0),
+      ('SALE_V_NEW', ogr.OFTReal, 11, 0),
+      ('SALE_V_DLT', ogr.OFTReal, 11, 0),
+      ('GEOM_CHG', ogr.OFTString, 1, 0)
+    ]
+    for name, field_type, width, precision in fields:
+      field = ogr.FieldDefn(name, field_type)
+      field.SetWidth(width)
+      field.SetPrecision(precision)
+      self.changes.CreateField(field)
+    self.changes_definition = self.changes.GetLayerDefn()
+
+
+  def write_change(self, change, old, new):
+    """
+    Write a change feature.  Returns False if nothing actually changed.
+    """
+    old_values = old[2] if old is not None else (None, None, None)
+    new_values = new[2] if new is not None else (None, None, None)
+    geometry_changed = old is not None and new is not None and old[3] != new[3]
+    if change == 'changed' and old_values == new_values and not geometry_changed:
+      return False
+
+    def delta(a, b):
+      return b - a if a is not None and b is not None else None
+
+    # Dates come back as strings like 2013/05/01; difference is in days
+    def date_delta(a, b):
+      try:
+        a, b = [datetime.date(*[int(p) for p in re.split('[^0-9]+', d.strip())[0:3]]) for d in [a, b]]
+      except (AttributeError, TypeError, ValueError):
+        return None
+      return (b - a).days
+
+    record = new if new is not None else old
+    feature = ogr.Feature(self.changes_definition)
+    feature.SetField('COUNTY_ID', record[0][0])
+    feature.SetField('PIN', record[0][1])
+    feature.SetField('CHANGE', change)
+    feature.SetField('EMV_OLD', old_values[0])
+    feature.SetField('EMV_NEW', new_values[0])
+    feature.SetField('EMV_DELTA', delta(old_values[0], new_values[0]))
+    feature.SetField('SALE_OLD', old_values[1])
+    feature.SetField('SALE_NEW', new_values[1])
+    feature.SetField('SALE_D_DLT', date_delta(old_values[1], new_values[1]))
+    feature.SetField('SALE_V_OLD', old_values[2])
+    feature.SetField('SALE_V_NEW', new_values[2])
+    feature.SetField('SALE_V_DLT', delta(old_values[2], new_values[2]))
+    feature.SetField('GEOM_CHG', 'Y' if geometry_changed else 'N')
+    if record[4] is not None:
+      feature.SetGeometry(ogr.CreateGeometryFromWkb(record[4]))
+
+    self.changes.CreateFeature(feature)
+    return True
+
+
+  def create_spatial_index(self):
+    """
+    Create spatial indexes (.qix) for the combined shards so that spatial
+    filters, like for extracts, do not have to read every feature.
+    """
+    for path in self.combined_shards():
+      self.out('- Creating spatial index for %s.\n' % (os.path.basename(path)))
+      shape = self.out_driver.Open(path, 1)
+      shape.ExecuteSQL('CREATE SPATIAL INDEX ON "%s"' % (shape.GetLayer().GetName()))
+      shape.Destroy()
+
+
+  def extract(self, output_path, bbox = None, counties = None, where = None, fields = None, compare = False, zoom = None):
+    """
+    Extract parcels from the combined output to GeoJSON, GeoJSONSeq,
+    GeoPackage, shapefile or TopoJSON, depending on the extension of
+    output_path.  The bounding box (minx, miny, maxx, maxy), counties (names
+    or IDs) and attribute filter (OGR SQL where clause) are pushed down to
+    the source so that the spatial index is used if there is one, and only
+    the wanted fields are read.  TopoJSON is quantized for zoom.
+    """
+    topojson = os.path.splitext(output_path)[1].lower() == '.topojson'
+    if not topojson:
+      driver_name = self.extract_drivers.get(os.path.splitext(output_path)[1].lower())
+      driver = ogr.GetDriverByName(driver_name) if driver_name else None
+      if driver is None:
+        raise OptionError('Unsupported extract format: %s' % (output_path))
+
+    layer = self.combined
+    definition = self.combined_definition
+    names = [definition.GetFieldDefn(i).GetNameRef() for i in range(0, definition.GetFieldCount())]
+    fields = fields or names
+    unknown = [f for f in fields if f not in names]
+    if len(unknown) > 0:
+      raise OptionError('Unknown fields: %s' % (', '.join(unknown)))
+
+    if not os.path.exists(os.path.dirname(os.path.abspath(output_path))):
+      os.makedirs(os.path.dirname(os.path.abspath(output_path)))
+
+    # Push filters down to the source.  Fields used by the filters have to be
+    # read for the filters to work; only the wanted fields are written.
+    start = time.time()
+    self.filter_combined(bbox, counties, where)
+    filtered = self.filter_fields(names, counties, where)
+    layer.SetIgnoredFields([n for n in names if n not in fields and n not in filtered])
+    indexed = bbox is not None and layer.TestCapability(ogr.OLCFastSpatialFilter)
+
+    if topojson:
+      count, arcs = self.write_topojson(output_path, fields, bbox, zoom or self.topojson_zoom)
+    else:
+      count = self.write_extract(driver, output_path, fields)
+    seconds = time.time() - start
+
+    self.out('- Extracted %s features to %s in %.2f seconds (%s).\n' % (count, output_path, seconds,
+      'spatial index' if indexed else ('no spatial index' if bbox is not None else 'no spatial filter')))
+    if topojson:
+      self.out('- TopoJSON has %s arcs and is %s bytes.\n' % (arcs, os.path.getsize(output_path)))
+
+    # Compare counting with the spatial filter to reading everything
+    if compare and bbox is not None:
+      for spatial_filter in [True, False]:
+        start = time.time()
+        counted = self.scan_count(bbox, counties, where, spatial_filter)
+        self.out('- Counting %s found %s features in %.2f seconds.\n' % (
+          'with the spatial filter' if spatial_filter else 'by reading every feature', counted, time.time() - start))
+
+    layer.SetIgnoredFields([])
+    self.filter_combined()
+
+
+  def write_extract(self, driver, output_path, fields):
+    """
+    Stream filtered features from the combined layer to an OGR output with
+    only the wanted fields.
+    """
+    definition = self.combined_definition
+    if os.path.exists(output_path):
+      driver.DeleteDataSource(output_path)
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(4326)
+    output = driver.CreateDataSource(output_path)
+    # Repaired parcels can be multipolygons, so the type is not fixed
+    output_layer = output.CreateLayer('metro_parcels', spatial_reference, ogr.wkbUnknown)
+    for name in fields:
+      output_layer.CreateField(definition.GetFieldDefn(definition.GetFieldIndex(name)))
+    output_definition = output_layer.GetLayerDefn()
+
+    # Stream features
+    count = 0
+    output_layer.StartTransaction()
+    for feature in self.combined:
+      output_feature = ogr.Feature(output_definition)
+      output_feature.SetFrom(feature)
+      output_layer.CreateFeature(output_feature)
+      count = count + 1
+    output_layer.CommitTransaction()
+    output.Destroy()
+    return count
+
+
+  def geometry_polygons(self, geometry):
+    """
+    Polygons of a geometry as lists of rings of (x, y).
+    """
+    if geometry is None:
+      return []
+
+    if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbMultiPolygon:
+      polygons = [geometry.GetGeometryRef(i) for i in range(0, geometry.GetGeometryCount())]
+    else:
+      polygons = [geometry]
+
+    return [[[p[0:2] for p in polygon.GetGeometryRef(i).GetPoints()] for i in range(0, polygon.GetGeometryCount())]
+      for polygon in polygons]
+
+
+  def write_topojson(self, output_path, fields, bbox, zoom):
+    """
+    Write filtered features from the combined layer to TopoJSON.  Edges
+    shared by parcels are stored once as arcs, coordinates are quantized to
+    about a pixel at zoom, and arcs are delta encoded.  The layer is read
+    twice, first to find junctions and then to cut arcs, and geometries are
+    written as they are read; see Topology for what is kept in memory.
+    """
+    layer = self.combined
+
+    # Grid of about a pixel at zoom; a pixel is shorter in degrees of
+    # latitude than longitude.
+    minx, maxx, miny, maxy = layer.GetExtent() if bbox is None else (bbox[0], bbox[2], bbox[1], bbox[3])
+    cell = 360.0 / (256 * (2 ** zoom))
+    temp_path = tempfile.mkdtemp(prefix = 'metro-parcels-topology-')
+    try:
+      return self.write_topology(Topology((minx, miny), (cell, cell * math.cos(math.radians((miny + maxy) / 2.0))),
+        temp_path, self.sort_chunk_size), output_path, fields)
+    finally:
+      shutil.rmtree(temp_path)
+
+
+  def write_topology(self, topology, output_path, fields):
+    """
+    Read the filtered features twice, to find junctions and then to cut
+    arcs, and write the TopoJSON.
+    """
+    layer = self.combined
+
+    # Find junctions
+    layer.ResetReading()
+    for feature in layer:
+      topology.add_junctions(self.geometry_polygons(feature.GetGeometryRef()))
+    topology.find_junctions()
+
+    # Write geometries, cutting arcs as they are read
+    if os.path.exists(output_path):
+      os.remove(output_path)
+    file = open(output_path, 'w')
+    file.write('{"type":"Topology","transform":%s,"objects":{"parcels":{"type":"GeometryCollection","geometries":[' % (
+      json.dumps(topology.transform(), separators = (',', ':'))))
+
+    count = 0
+    layer.ResetReading()
+    for feature in layer:
+      geometry = topology.geometry(self.geometry_polygons(feature.GetGeometryRef()))
+      geometry['properties'] = dict((name, feature.GetField(name)) for name in fields)
+      file.write((',' if count > 0 else '') + json.dumps(geometry, separators = (',', ':')))
+      count = count + 1
+
+    file.write(']}},"arcs":[')
+    for i, arc in enumerate(topology.encoded_arcs()):
+      file.write((',' if i > 0 else '') + arc)
+    file.write(']}\n')
+    file.close()
+
+    return count, topology.arc_count
+
+
+  def filter_combined(self, bbox = None, counties = None, where = None):
+    """
+    Set (or clear) the spatial and attribute filters on the combined layer.
+    """
+    if bbox is not None:
+      self.combined.SetSpatialFilterRect(*bbox)
+    else:
+      self.combined.SetSpatialFilter(None)
+
+    clauses = []
+    if counties:
+      ids = [self.county_ids.get(c.lower(), c) for c in counties]
+      clauses.append('COUNTY_ID IN (%s)' % (', '.join("'%s'" % (i) for i in ids)))
+    if where:
+      clauses.append('(%s)' % (where))
+
+    if self.combined.SetAttributeFilter(' AND '.join(clauses) if clauses else None) != 0:
+      raise OptionError('Could not use attribute filter: %s' % (where))
+
+
+  def filter_fields(self, names, counties = None, where = None):
+    """
+    Fields that the county and attribute filters use.
+    """
+    used = ['COUNTY_ID'] if counties else []
+    if where:
+      used = used + [n for n in names if re.search(r'\b%s\b' % (re.escape(n)), where, re.IGNORECASE)]
+    return used
+
+
+  def scan_count(self, bbox, counties = None, where = None, spatial_filter = False):
+    """
+    Count features that intersect a bounding box, either using the spatial
+    filter (and index, if there is one) or reading every feature.  Both do
+    the same intersects test so that their times can be compared.
+    """
+    minx, miny, maxx, maxy = bbox
+    rectangle = ogr.CreateGeometryFromWkt('POLYGON ((%r %r, %r %r, %r %r, %r %r, %r %r))' % (
+      minx, miny, maxx, miny, maxx, maxy, minx, maxy, minx, miny))
+    self.filter_combined(bbox if spatial_filter else None, counties, where)
+    count = 0
+    for feature in self.combined:
+      geometry = feature.GetGeometryRef()
+      if geometry is not None and geometry.Intersects(rectangle):
+        count = count + 1
+    return count
+
+
+  def write_attribute_store(self, path = None):
+    """
+    Write the fields used for map interactivity to an attribute store,
+    where row n is the parcel with PARCEL_KEY n; see AttributeStore.
+    """
+    import progressbar
+
+    path = path or self.attribute_store
+    definition = self.combined_definition
+    if definition.GetFieldIndex('PARCEL_KEY') < 0:
+      raise SourceError('The combined output does not have PARCEL_KEY; combine again to add it.')
+
+    # Numbers are stored as doubles and everything else as text
+    columns = []
+    for name in self.attribute_fields:
+      index = definition.GetFieldIndex(name)
+      if index < 0:
+        raise OptionError('Unknown field for attribute store: %s' % (name))
+      columns.append((name, 'float' if definition.GetFieldDefn(index).GetType() in [ogr.OFTReal, ogr.OFTInteger] else 'string'))
+
+    # Only read the stored fields
+    self.combined.SetIgnoredFields(['OGR_GEOMETRY'] + [definition.GetFieldDefn(i).GetNameRef()
+      for i in range(0, definition.GetFieldCount())
+      if definition.GetFieldDefn(i).GetNameRef() not in self.attribute_fields + ['PARCEL_KEY']])
+
+    count = self.combined.GetFeatureCount()
+    widgets = ['- Writing attributes for %s features: ' % (count), progressbar.Percentage(), ' ', progressbar.Bar(), ' ', progressbar.ETA()]
+    progress = progressbar.ProgressBar(widgets = widgets, maxval = count).start()
+    completed = 0
+
+    # Shards are read in the order they were written, so keys come in order
+    writer = AttributeStoreWriter(path, columns)
+    for feature in self.combined:
+      writer.add(feature.GetField('PARCEL_KEY'), [feature.GetField(name) for name, column_type in columns])
+      completed = completed + 1
+      progress.update(completed)
+    writer.close()
+
+    progress.finish()
+    self.combined.ResetReading()
+    self.combined.SetIgnoredFields([])
+    self.out('- Wrote attributes for %s parcels (%s bytes) to %s.\n' % (writer.count, os.path.getsize(path), path))
+
+
+  def write_attribute_chunks(self, path = None, chunks_path = None):
+    """
+    Publish the attribute store as static JSONP files that the app can get
+    from wherever it is deployed.  chunk-<n>.js has the parcels with keys
+    from n * attribute_chunk_size, and calls mpParcelAttributes<n> with
+    { start, fields, rows }.
+    """
+    store = AttributeStore(path or self.attribute_store)
+    chunks_path = chunks_path or self.attribute_chunks
+    if os.path.exists(chunks_path):
+      shutil.rmtree(chunks_path)
+    os.makedirs(chunks_path)
+
+    fields = [c['name'] for c in store.columns]
+    for chunk in range(0, int(math.ceil(len(store) / float(self.attribute_chunk_size)))):
+      start = chunk * self.attribute_chunk_size
+      rows = []
+      for key in range(start, min(start + self.attribute_chunk_size, len(store))):
+        attributes = store.get(key)
+        rows.append([attributes[name] for name in fields])
+
+      file = open(os.path.join(chunks_path, 'chunk-%s.js' % (chunk)), 'w')
+      file.write('mpParcelAttributes%s(%s);\n' % (chunk, json.dumps({ 'start': start, 'fields': fields, 'rows': rows }, separators = (',', ':'))))
+      file.close()
+
+    self.out('- Wrote attributes for %s parcels in chunks of %s to %s.\n' % (len(store), self.attribute_chunk_size, chunks_path))
+    store.close()
+
+
+  def serve_attributes(self, path = None, port = None):
+    """
+    Serve the attribute store over HTTP for development.  GET
+    /attributes/<key> returns the attributes for a parcel as JSON, and
+    /attributes/<key>,<key> a map of key to attributes.  A callback
+    parameter wraps the response for JSONP.
+    """
+    try:
+      from http.server import HTTPServer, BaseHTTPRequestHandler
+      from urllib.parse import urlparse, parse_qs
+    except ImportError:
+      from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+      from urlparse import urlparse, parse_qs
+
+    store = AttributeStore(path or self.attribute_store)
+    port = port or self.attribute_port
+
+    class AttributeHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        try:
+          if len(parts) != 2 or parts[0] != 'attributes':
+            raise ValueError()
+          keys = [int(k) for k in parts[1].split(',')]
+        except ValueError:
+          return self.respond(404, { 'error': 'Not found' }, url)
+
+        found = dict((k, store.get(k)) for k in keys)
+        if None in found.values():
+          return self.respond(404, { 'error': 'Unknown parcel key' }, url)
+        self.respond(200, found[keys[0]] if len(keys) == 1 else found, url)
+
+      def respond(self, status, data, url):
+        body = json.dumps(data, separators = (',', ':'))
+        callback = parse_qs(url.query).get('callback')
+        content_type = 'application/json'
+        if callback:
+          # Only plain function names, so nothing else can be run
+          if not re.match(r'^[A-Za-z_$][A-Za-z0-9_$.]*\Z', callback[0]):
+            status = 400
+            body = json.dumps({ 'error': 'Invalid callback' })
+          else:
+            body = '%s(%s);' % (callback[0], body)
+            content_type = 'application/javascript'
+
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    server = HTTPServer(('localhost', port), AttributeHandler)
+    self.out('- Serving %s parcel attributes at http://localhost:%s/attributes/<key>\n' % (len(store), port))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    server.server_close()
+    store.close()
+
+
+  def process(self, args = None):
+    """
+    Main execution handler.  Arguments default to the command line.
     """
     self.argparser = argparse.ArgumentParser(description = self.description, formatter_class = argparse.RawDescriptionHelpFormatter,)
 
@@ -777,9 +1841,176 @@ class MetroParcels():
       action = 'store_true'
     )
 
+    # Sharding of output
+    self.argparser.add_argument(
+      '--shard-by',
+      help = 'How to split the combined output into shards to stay under shapefile size limits; either "size" (default) or "county".',
+      choices = ['size', 'county'],
+      default = self.shard_by
+    )
+
+    self.argparser.add_argument(
+      '--shard-max-bytes',
+      help = 'Maximum size of a shard .shp or .dbf in bytes.',
+      type = int,
+      default = self.shard_max_bytes
+    )
+
+    self.argparser.add_argument(
+      '--processes',
+      help = 'Number of counties to combine at the same time; needs --shard-by county.',
+      type = int,
+      default = self.processes
+    )
+
+    # Diff
+    self.argparser.add_argument(
+      '--diff',
+      help = 'Output the changes between two combined outputs (.shp or .vrt), for example last year\'s and this year\'s.',
+      nargs = 2,
+      metavar = ('OLD', 'NEW'),
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--diff-output',
+      help = 'Where to write the changes from --diff.',
+      default = self.diff_output
+    )
+
+    self.argparser.add_argument(
+      '--sort-chunk-size',
+      help = 'Number of records to sort in memory at a time for --diff and TopoJSON extracts.',
+      type = int,
+      default = self.sort_chunk_size
+    )
+
+    # Extract
+    self.argparser.add_argument(
+      '--extract',
+      help = 'Extract parcels from the combined output to this file; the format is from the extension: .geojson, .geojsonl (GeoJSONSeq), .gpkg, .shp, or .topojson.',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--extract-bbox',
+      help = 'Bounding box to extract, as "minx,miny,maxx,maxy" in longitude and latitude.',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--extract-counties',
+      help = 'Comma separated counties to extract, by name or ID, for example "hennepin,62".',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--extract-where',
+      help = 'Attribute filter for extracting, for example "EMV_TOTAL > 500000".',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--extract-fields',
+      help = 'Comma separated fields to include in the extract; defaults to all.',
+      default = None
+    )
+
+    self.argparser.add_argument(
+      '--extract-zoom',
+      help = 'Zoom level to quantize TopoJSON extracts for; defaults to %s.' % (self.topojson_zoom),
+      type = int,
+      default = self.topojson_zoom
+    )
+
+    self.argparser.add_argument(
+      '--extract-compare',
+      help = 'Also time counting the features in the bounding box with and without the spatial filter, for comparison.',
+      action = 'store_true'
+    )
+
+    self.argparser.add_argument(
+      '--spatial-index',
+      help = 'Create spatial indexes for the existing combined output, then extract if --extract is given.',
+      action = 'store_true'
+    )
+
+    # Geometry validation
+    self.argparser.add_argument(
+      '--validate',
+      help = 'Validate geometries when combining and repair invalid ones; needs Shapely 2.',
+      action = 'store_true'
+    )
+
+    self.argparser.add_argument(
+      '--validate-processes',
+      help = 'Number of processes to validate geometries in.',
+      type = int,
+      default = self.validate_processes
+    )
+
+    self.argparser.add_argument(
+      '--validation-cache',
+      help = 'Where to cache validation results between runs.',
+      default = self.validation_cache
+    )
+
+    self.argparser.add_argument(
+      '--validation-report',
+      help = 'Where to write the report of repaired geometries.',
+      default = self.validation_report
+    )
+
+    # Attribute store
+    self.argparser.add_argument(
+      '--attribute-store',
+      help = 'Where to write the attribute store for map interactivity; it is written after combining.',
+      default = self.attribute_store
+    )
+
+    self.argparser.add_argument(
+      '--attribute-store-only',
+      help = 'Write the attribute store (and its chunks for the app) from the existing combined output without combining.',
+      action = 'store_true'
+    )
+
+    self.argparser.add_argument(
+      '--serve-attributes',
+      help = 'Serve the attribute store over HTTP for development, on this port (%s is used by the local app).' % (self.attribute_port),
+      type = int,
+      nargs = '?',
+      const = self.attribute_port,
+      default = None
+    )
+
     # Parse options
-    self.args = self.argparser.parse_args()
+    self.args = self.argparser.parse_args(args)
+    self.shard_by = self.args.shard_by
+    self.shard_max_bytes = self.args.shard_max_bytes
+    self.processes = self.args.processes
+    if self.processes > 1 and self.shard_by != 'county':
+      self.error('--processes needs --shard-by county\n')
+      sys.exit(1)
+
+    self.validate = self.args.validate
+    self.validate_processes = self.args.validate_processes
+    self.validation_cache = self.args.validation_cache
+    self.validation_report = self.args.validation_report
+    if self.validate and self.processes > 1:
+      self.error('--validate does not work with --processes; use --validate-processes\n')
+      sys.exit(1)
+
+    try:
+      self.run()
+    except (SourceError, OptionError) as e:
+      self.error('%s\n' % (e))
+      sys.exit(1)
 
+
+  def run(self):
+    """
+    Do what the parsed options ask for.
+    """
     # Output field defintion if so
     if self.args.field_definition not in [None, '', 0]:
       self.output_field_definitions(self.args.field_definition)
@@ -791,6 +2022,44 @@ class MetroParcels():
       self.output_field_source(source, field, int(limit))
       return
 
+    # Attribute store
+    self.attribute_store = self.args.attribute_store
+    if self.args.serve_attributes is not None:
+      self.serve_attributes(self.attribute_store, self.args.serve_attributes)
+      return
+
+    if self.args.attribute_store_only:
+      self.define_combined(False, False)
+      self.write_attribute_store()
+      self.write_attribute_chunks()
+      self.close()
+      return
+
+    # Diff two combined outputs
+    self.sort_chunk_size = self.args.sort_chunk_size
+    if self.args.diff is not None:
+      self.diff(self.args.diff[0], self.args.diff[1], self.args.diff_output)
+      return
+
+    # Spatial index
+    if self.args.spatial_index:
+      self.create_spatial_index()
+      if self.args.extract in [None, '', 0]:
+        return
+
+    # Extract
+    if self.args.extract not in [None, '', 0]:
+      self.define_combined(False, False)
+      self.extract(self.args.extract,
+        [float(c) for c in self.args.extract_bbox.split(',')] if self.args.extract_bbox else None,
+        self.args.extract_counties.split(',') if self.args.extract_counties else None,
+        self.args.extract_where,
+        self.args.extract_fields.split(',') if self.args.extract_fields else None,
+        self.args.extract_compare,
+        self.args.extract_zoom)
+      self.close()
+      return
+
     # Output field values for combined
     if self.args.field_values_first not in [None, '', 0]:
       self.define_combined(False, False)
@@ -811,15 +2080,26 @@ class MetroParcels():
 
     # Set up shape to write to
     self.define_combined()
+    if self.validate:
+      self.start_validation()
 
     # Combine sources.  For some reason if we do hennepin first, it hangs
     # on anoka
-    self.combine('ramsey')
-    self.combine('anoka')
-    self.combine('hennepin')
+    if self.processes > 1:
+      self.combine_parallel(self.combine_order)
+    else:
+      for county in self.combine_order:
+        self.combine(county)
+
+    # Spatial reference and manifest
+    self.finish_combined()
+    if self.validate:
+      self.finish_validation()
 
-    # Spatial reference stuff
-    self.make_spatial_reference()
+    # Read back what was written for the attribute store
+    self.define_combined(False, False)
+    self.write_attribute_store()
+    self.write_attribute_chunks()
 
     # Output field defintion if so
     if self.args.field_values_last not in [None, '', 0]:
@@ -829,6 +2109,23 @@ class MetroParcels():
     self.close()
 
 
+def combine_county_shards(arguments):
+  """
+  Combine a county into its own shards; used for combining in parallel.
+  Returns the paths of the shards written.
+  """
+  county, options = arguments
+  mp = MetroParcels()
+  for name, value in options.items():
+    setattr(mp, name, value)
+
+  mp.start_shards()
+  mp.combine(county)
+  mp.close()
+  return mp.shards
+
+
 # Handle execution
 if __name__ == '__main__':
   mp = MetroParcels()
+  mp.process()
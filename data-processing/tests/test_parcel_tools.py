@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for parcel_tools.  Run with: python -m pytest data-processing/tests
+"""
+
+
+import os, sys, shutil, struct, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from parcel_tools import Topology, AttributeStore, AttributeStoreWriter, check_geometries, merge_join
+
+try:
+  import shapely
+except ImportError:
+  shapely = None
+
+
+class TopologyTest(unittest.TestCase):
+  """
+  Topology for small hand made polygons.
+  """
+
+  def setUp(self):
+    self.temp_path = tempfile.mkdtemp()
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_path)
+
+
+  def topology(self, polygons, chunk_size = 200000):
+    topology = Topology((0, 0), (1, 1), self.temp_path, chunk_size)
+    for p in polygons:
+      topology.add_junctions(p)
+    topology.find_junctions()
+    return topology
+
+
+  def test_quantize(self):
+    topology = Topology((10, 20), (0.5, 0.5), self.temp_path)
+    self.assertEqual(topology.quantize([(10, 20), (10.1, 20), (11, 20), (11, 21), (10, 20)]), [(0, 0), (2, 0), (2, 2)])
+    self.assertIsNone(topology.quantize([(10, 20), (10.1, 20.1), (10, 20)]))
+
+
+  def test_shared_edge(self):
+    left = [[[(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]]]
+    right = [[[(1, 0), (2, 0), (2, 1), (1, 1), (1, 0)]]]
+
+    # Small chunks so the points are sorted in more than one run
+    topology = self.topology([left, right], 3)
+    self.assertEqual(topology.junctions, set([(1, 0), (1, 1)]))
+
+    first = topology.geometry(left)
+    second = topology.geometry(right)
+    self.assertEqual(first['type'], 'Polygon')
+    self.assertEqual(topology.arc_count, 3)
+
+    # The shared edge is one arc, used backwards by the second polygon
+    shared = [a for a in first['arcs'][0] if ~a in second['arcs'][0]]
+    self.assertEqual(len(shared), 1)
+    self.assertEqual(len(list(topology.encoded_arcs())), 3)
+
+
+  def test_ring_without_junctions(self):
+    ring = [[[(5, 5), (6, 5), (6, 6), (5, 5)]]]
+    rotated = [[[(6, 5), (6, 6), (5, 5), (6, 5)]]]
+    topology = self.topology([ring, rotated])
+    self.assertEqual(topology.geometry(ring), { 'type': 'Polygon', 'arcs': [[0]] })
+    self.assertEqual(topology.geometry(rotated), { 'type': 'Polygon', 'arcs': [[0]] })
+    self.assertEqual(list(topology.encoded_arcs()), ['[[5,5],[1,0],[0,1],[-1,-1]]'])
+
+
+  def test_multipolygon_and_empty(self):
+    multi = [[[(0, 0), (1, 0), (1, 1), (0, 0)]], [[(3, 3), (4, 3), (4, 4), (3, 3)]]]
+    topology = self.topology([multi])
+    self.assertEqual(topology.geometry(multi)['type'], 'MultiPolygon')
+    self.assertEqual(topology.geometry([]), { 'type': None })
+
+
+class AttributeStoreTest(unittest.TestCase):
+  """
+  Writing and reading attribute stores.
+  """
+
+  def setUp(self):
+    self.temp_path = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_path, 'attributes.bin')
+
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_path)
+
+
+  def test_round_trip(self):
+    writer = AttributeStoreWriter(self.path, [('PIN', 'string'), ('EMV_TOTAL', 'float'), ('USE1_DESC', 'string')])
+    writer.add(0, ['0123', 250000, u'Résidential'])
+    writer.add(1, [None, None, None])
+    writer.add(3, ['0456', 1.5, 'Commercial'])
+    writer.close()
+
+    store = AttributeStore(self.path)
+    self.assertEqual(len(store), 4)
+    self.assertEqual(store.get(0), { 'PIN': '0123', 'EMV_TOTAL': 250000.0, 'USE1_DESC': u'Résidential' })
+    self.assertEqual(store.get(1), { 'PIN': None, 'EMV_TOTAL': None, 'USE1_DESC': None })
+    self.assertEqual(store.get(2), { 'PIN': None, 'EMV_TOTAL': None, 'USE1_DESC': None })
+    self.assertEqual(store.get(3), { 'PIN': '0456', 'EMV_TOTAL': 1.5, 'USE1_DESC': 'Commercial' })
+    self.assertIsNone(store.get(4))
+    self.assertIsNone(store.get(-1))
+    store.close()
+
+
+  def test_out_of_order(self):
+    writer = AttributeStoreWriter(self.path, [('PIN', 'string')])
+    writer.add(1, ['a'])
+    self.assertRaises(ValueError, writer.add, 0, ['b'])
+
+
+  def test_not_a_store(self):
+    with open(self.path, 'wb') as f:
+      f.write(b'\0' * 32)
+    self.assertRaises(ValueError, AttributeStore, self.path)
+
+
+class MergeJoinTest(unittest.TestCase):
+  """
+  Merge joining sorted records for diffs.
+  """
+
+  def changes(self, old, new):
+    return [(c, o[1] if o else None, n[1] if n else None) for c, o, n in merge_join(iter(old), iter(new))]
+
+
+  def test_added_removed_changed(self):
+    old = [(('2', 'A'), 0), (('2', 'B'), 1), (('62', 'C'), 2)]
+    new = [(('2', 'B'), 0), (('27', 'D'), 1), (('62', 'C'), 2)]
+    self.assertEqual(self.changes(old, new), [
+      ('removed', 0, None),
+      ('changed', 1, 0),
+      ('added', None, 1),
+      ('changed', 2, 2)
+    ])
+
+
+  def test_duplicate_keys(self):
+    old = [(('2', 'A'), 0), (('2', 'A'), 1)]
+    new = [(('2', 'A'), 0)]
+    self.assertEqual(self.changes(old, new), [('changed', 0, 0), ('removed', 1, None)])
+
+
+  def test_without_pin(self):
+    old = [(('2', ''), 0), (('2', ''), 1)]
+    new = [(('2', ''), 0)]
+    self.assertEqual(self.changes(old, new), [('removed', 0, None), ('removed', 1, None), ('added', None, 0)])
+
+
+  def test_without_pin_is_streamed(self):
+    # Records are yielded before the rest of the key is read
+    def records():
+      yield (('2', ''), 0)
+      raise AssertionError('Read past the first record')
+    changes = merge_join(records(), iter([(('2', ''), 0)]))
+    self.assertEqual(next(changes)[0], 'removed')
+
+
+  def test_empty(self):
+    self.assertEqual(self.changes([], []), [])
+
+
+@unittest.skipIf(shapely is None, 'Shapely is not installed')
+class CheckGeometriesTest(unittest.TestCase):
+  """
+  Validating and repairing geometries with Shapely.
+  """
+
+  def test_check(self):
+    valid = shapely.to_wkb(shapely.Polygon([(0, 0), (1, 0), (1, 1), (0, 1)]))
+    bowtie = shapely.to_wkb(shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1)]))
+    flat = shapely.to_wkb(shapely.Polygon([(0, 0), (1, 0), (2, 0)]))
+    results = check_geometries([valid, bowtie, flat])
+
+    self.assertIsNone(results[0])
+
+    wkb, reason = results[1]
+    repaired = shapely.from_wkb(wkb)
+    self.assertTrue(repaired.is_valid)
+    self.assertEqual(repaired.geom_type, 'MultiPolygon')
+    self.assertAlmostEqual(repaired.area, 0.5)
+    self.assertIn('Self-intersection', reason)
+
+    self.assertIsNone(results[2][0])
+
+
+  def test_unreadable(self):
+    # A ring that is not closed can not be read by GEOS
+    valid = shapely.to_wkb(shapely.Polygon([(0, 0), (1, 0), (1, 1), (0, 1)]))
+    unclosed = struct.pack('<BIII', 1, 3, 1, 4) + struct.pack('<8d', 0, 0, 1, 0, 1, 1, 0, 1)
+    results = check_geometries([unclosed, valid])
+    self.assertEqual(results[0], (None, 'Unreadable geometry'))
+    self.assertIsNone(results[1])
+
+
+  def test_empty(self):
+    self.assertEqual(check_geometries([]), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
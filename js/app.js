@@ -47,6 +47,8 @@ define('minnpost-metro-parcels', [
 
       // Make tooltip template
       this.tooltipTemplate = _.template(tTooltip);
+      this.parcelAttributes = {};
+      this.attributeChunks = {};
 
       // Get tilejson data manually, in case we want to do something awesome
       // with it
@@ -86,7 +88,29 @@ define('minnpost-metro-parcels', [
           return;
         }
 
+        var control = this;
         var template = this.options.template || this._layer.getTileJSON().template;
+        var key = data.PARCEL_KEY;
+
+        // Grids may only have the parcel key, in which case the rest of
+        // the attributes come from the attribute store.
+        if (template && !_.isUndefined(key) && _.isUndefined(data.EMV_TOTAL) && thisApp.options.paths.attributes) {
+          thisApp.currentParcelKey = key;
+          if (_.isUndefined(thisApp.parcelAttributes[key])) {
+            thisApp.getParcelAttributes(key, function(attributes) {
+              if (thisApp.currentParcelKey === key && control._contentWrapper) {
+                control._contentWrapper.innerHTML = (attributes) ? control._template(format, attributes) :
+                  '<div class="error">Could not load the details for this parcel.</div>';
+              }
+            });
+          }
+
+          // Chunks that are already loaded are used right away
+          if (_.isUndefined(thisApp.parcelAttributes[key])) {
+            return '<div class="loading">Loading...</div>';
+          }
+          data = thisApp.parcelAttributes[key];
+        }
 
         if (template) {
           return this.options.sanitizer(
@@ -140,6 +164,40 @@ define('minnpost-metro-parcels', [
 
     },
 
+    // Get attributes for a parcel key from the attribute store, which is
+    // published as static JSONP chunks of parcels; see --attribute-store in
+    // data-processing/process-shapefiles.py.  Calls done with null if the
+    // attributes could not be found.
+    getParcelAttributes: function(key, done) {
+      var thisApp = this;
+      var chunk = Math.floor(key / this.options.attributesChunkSize);
+
+      if (!this.attributeChunks[chunk]) {
+        this.attributeChunks[chunk] = $.ajax({
+          url: this.options.paths.attributes + 'chunk-' + chunk + '.js',
+          dataType: 'jsonp',
+          jsonp: false,
+          jsonpCallback: 'mpParcelAttributes' + chunk,
+          cache: true,
+          timeout: 15000
+        });
+      }
+
+      this.attributeChunks[chunk]
+        .done(function(data) {
+          var row = data.rows[key - data.start];
+          if (row) {
+            thisApp.parcelAttributes[key] = _.object(data.fields, row);
+          }
+          done(row ? thisApp.parcelAttributes[key] : null);
+        })
+        .fail(function() {
+          // Try again next time
+          delete thisApp.attributeChunks[chunk];
+          done(null);
+        });
+    },
+
     // Make the data a tad better
     parseParcelData: function(data) {
       data.BUILD_YR = (data.BUILD_YR == '0000' || data.BUILD_YR < 1) ? null : data.BUILD_YR;
@@ -158,11 +216,14 @@ define('minnpost-metro-parcels', [
       mapbox_base: '//{s}.tiles.mapbox.com/v3/',
       mapbox_map: 'minnpost.wqqcl3di',
       mapbox_composite: 'minnpost.map-vhjzpwel,minnpost.wqqcl3di,minnpost.map-dotjndlk',
+      // Has to match attribute_chunk_size in data-processing/process-shapefiles.py
+      attributesChunkSize: 1000,
       availablePaths: {
         local: {
           css: ['.tmp/css/main.css'],
           images: 'images/',
-          data: 'data/'
+          data: 'data/',
+          attributes: 'data/attributes/'
         },
         build: {
           css: [
@@ -175,7 +236,8 @@ define('minnpost-metro-parcels', [
             'dist/minnpost-metro-parcels.latest.min.ie.css'
           ],
           images: 'dist/images/',
-          data: 'dist/data/'
+          data: 'dist/data/',
+          attributes: 'dist/data/attributes/'
         },
         deploy: {
           css: [
@@ -186,7 +248,8 @@ define('minnpost-metro-parcels', [
             'https://s3.amazonaws.com/data.minnpost/projects/minnpost-metro-parcels/minnpost-metro-parcels.latest.min.ie.css'
           ],
           images: 'https://s3.amazonaws.com/data.minnpost/projects/minnpost-metro-parcels/images/',
-          data: 'https://s3.amazonaws.com/data.minnpost/projects/minnpost-metro-parcels/data/'
+          data: 'https://s3.amazonaws.com/data.minnpost/projects/minnpost-metro-parcels/data/',
+          attributes: 'https://s3.amazonaws.com/data.minnpost/projects/minnpost-metro-parcels/data/attributes/'
         }
       }
     },